@@ -1,10 +1,17 @@
+import numpy as np
+
 from ase import Atoms
 from ase.utils import writer
+from itertools import chain, islice
 from tqdm import tqdm
 
+from .xdatcar import xdatcar_header, write_xdatcar_frames
+
 
 @writer
-def write_xdatcar_from_traj(fd, images, verbose=True):
+def write_xdatcar_from_traj(
+    fd, images, verbose=True, direct=True, fixed_cell=False, stride=1, block=1024
+):
     """Write VASP MD trajectory (XDATCAR) file
 
     written in order to generate an output compatible with VASPKIT package for postprocessing analysis
@@ -14,9 +21,14 @@ def write_xdatcar_from_traj(fd, images, verbose=True):
         images (iterable of Atoms): Atoms images to write. These must have
             consistent atom order and lattice vectors - this will not be
             checked.
+        direct (bool): write direct coordinates instead of cartesian ones
+        fixed_cell (bool): write the cell only once in the header, taking
+            the one of the first image
+        stride (int): write one image every stride
+        block (int): number of images formatted at once
     """
 
-    images = iter(images)
+    images = islice(images, 0, None, stride)
     image = next(images)
 
     if not isinstance(image, Atoms):
@@ -24,42 +36,32 @@ def write_xdatcar_from_traj(fd, images, verbose=True):
 
     symbol_count = __symbol_count_from_symbols(image.get_chemical_symbols())
 
-    __write_xdatcar_config(fd, image, symbol_count, 1)
+    if fixed_cell:
+        fd.write(xdatcar_header(symbol_count, image.cell.array))
 
-    iteration = tqdm(enumerate(images)) if verbose else enumerate(images)
-    for i, image in iteration:
-        # Index is off by 2: 1-indexed file vs 0-indexed Python;
-        # and we already wrote the first block.
-        __write_xdatcar_config(fd, image, symbol_count, i + 2)
+    images = chain([image], images)
+    progress = tqdm(disable=not verbose)
 
+    index = 1
+    while True:
+        chunk = list(islice(images, block))
+        if len(chunk) == 0:
+            break
 
-def __write_xdatcar_config(fd, atoms: Atoms, symbol_count, index):
-    """Write a block of positions and lattice vectors for XDATCAR file
+        cells = np.array([atoms.cell.array for atoms in chunk])
+        if direct:
+            posis = np.array(
+                [atoms.get_scaled_positions(wrap=False) for atoms in chunk]
+            )
+        else:
+            posis = np.array([atoms.positions for atoms in chunk])
 
-    Args:
-        fd (fd): writeable Python file descriptor
-        atoms (ase.Atoms): Atoms to write
-        index (int): configuration number written to block header
-    """
-    # Not using lattice constants, set it to 1
-    fd.write("unknown system\n")
-    fd.write("           1\n")
-
-    # Lattice vectors; use first image
-    float_string = "{:11.6f}"
-    for row_i in range(3):
-        fd.write("  ")
-        fd.write(" ".join(float_string.format(x) for x in atoms.cell.array[row_i]))
-        fd.write("\n")
-
-    __write_symbol_count(fd, symbol_count)
-    fd.write("Direct configuration={:6d}\n".format(index))
-    float_string = "{:11.8f}"
-    scaled_positions = atoms.get_scaled_positions(wrap=False)
-    for row in scaled_positions:
-        fd.write(" ")
-        fd.write(" ".join([float_string.format(x) for x in row]))
-        fd.write("\n")
+        write_xdatcar_frames(fd, symbol_count, cells, posis, index, direct, fixed_cell)
+
+        index += len(chunk)
+        progress.update(len(chunk))
+
+    progress.close()
 
 
 def __symbol_count_from_symbols(symbols):
@@ -83,27 +85,3 @@ def __symbol_count_from_symbols(symbols):
             count += 1
     sc.append((psym, count))
     return sc
-
-
-def __write_symbol_count(fd, sc, vasp5=True):
-    """Write the symbols and numbers block for POSCAR or XDATCAR
-
-    Args:
-        f (fd): Descriptor for writable file
-        sc (list of 2-tuple): list of paired elements and counts
-        vasp5 (bool): if False, omit symbols and only write counts
-
-    e.g. if sc is [(Sn, 4), (S, 6)] then write::
-
-      Sn   S
-       4   6
-
-    """
-    if vasp5:
-        for sym, _ in sc:
-            fd.write(" {:3s}".format(sym))
-        fd.write("\n")
-
-    for _, count in sc:
-        fd.write(" {:3d}".format(count))
-    fd.write("\n")
@@ -0,0 +1,407 @@
+"""Script to store processed trajectories and analysis results next to their source file as numpy arrays"""
+
+# ---- IMPORT
+
+# Numpy
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# OS
+import os
+import json
+from hashlib import sha1
+from collections import OrderedDict
+from threading import Lock
+from tempfile import TemporaryFile
+from os.path import abspath, basename, dirname, getmtime, getsize, isfile, join
+
+# Typing
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from numpy import ndarray
+from numpy.typing import DTypeLike
+
+# ---- FUNCTION
+
+
+def cache_dir(path: str) -> str:
+    """
+    Directory, placed next to the source file, where the cache of the file is stored
+    """
+    path = abspath(path)
+
+    return join(dirname(path), f".{basename(path)}.luffa")
+
+
+def source_stamp(path: str) -> Dict[str, object]:
+    """
+    Identity of the source file, a change in any of the entries invalidates its cache
+    """
+    return {"path": abspath(path), "size": getsize(path), "mtime": getmtime(path)}
+
+
+def cache_key(path: Union[str, List[str]], **params) -> str:
+    """
+    Key of the cache entry, built from the identity of the source file, or files for trajectories split in
+    segments, and the parameters used to process it
+    """
+    if isinstance(path, str):
+        source = source_stamp(path)
+    else:
+        source = [source_stamp(x) for x in path]
+
+    stamp = json.dumps([source, params], sort_keys=True, default=str)
+
+    return sha1(stamp.encode()).hexdigest()
+
+
+def _is_stale(source: Union[Dict[str, object], List[Dict[str, object]]]) -> bool:
+    """
+    Whether any of the source files of an entry, all the segments for split trajectories, changed or disappeared
+    """
+    stamps = [source] if isinstance(source, dict) else source
+
+    return any(
+        not isfile(stamp["path"]) or source_stamp(stamp["path"]) != stamp
+        for stamp in stamps
+    )
+
+
+def _drop_stale(folder: str) -> None:
+    """
+    Remove all the files of the cache entries that refer to an older version of their source files, the entries
+    being named by the key before the first underscore of their metadata
+    """
+    stale_keys = []
+    for name in os.listdir(folder):
+        if not name.endswith(".json"):
+            continue
+
+        try:
+            with open(join(folder, name), "r") as file:
+                stale = _is_stale(json.load(file)["source"])
+        except (OSError, ValueError, KeyError, TypeError):
+            stale = True
+
+        if stale:
+            stale_keys.append(name[:-5].split("_")[0])
+
+    for name in os.listdir(folder):
+        if any(name.startswith(key) for key in stale_keys):
+            os.remove(join(folder, name))
+
+
+def _source(path: Union[str, List[str]]) -> Tuple[str, object]:
+    """
+    Cache folder and identity of the source of an entry, for trajectories split in segments the folder of the
+    first segment and the identity of all of them
+    """
+    if isinstance(path, str):
+        return cache_dir(path), source_stamp(path)
+
+    return cache_dir(path[0]), [source_stamp(x) for x in path]
+
+
+def load_trajectory(
+    path: Union[str, List[str]], key: str
+) -> Optional[Tuple[Dict[str, int], ndarray, ndarray]]:
+    """
+    Load the cached atomic species, cells and positions of the trajectory, the arrays are memory mapped
+    and so only the pages actually used are read from disk. Returns None if no valid entry is found
+    """
+    root = join(cache_dir(path if isinstance(path, str) else path[0]), key)
+
+    if not isfile(root + ".json"):
+        return None
+
+    try:
+        with open(root + ".json", "r") as file:
+            meta = json.load(file)
+
+        cells = np.load(root + "_cells.npy", mmap_mode="r")
+        posis = np.load(root + "_posis.npy", mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+    # Positions stored atom by atom, in arrays that may hold more frames than the written ones
+    if meta.get("order") == "atoms":
+        n_frames = meta["frames"]
+        cells, posis = cells[:n_frames], posis[:, :n_frames].transpose(1, 0, 2)
+
+    return meta["atoms"], cells, posis
+
+
+def create_trajectory(
+    path: Optional[Union[str, List[str]]],
+    key: str,
+    n_frames: int,
+    n_atoms: int,
+    dtype: DTypeLike = np.float64,
+) -> Tuple[ndarray, ndarray]:
+    """
+    Memory mapped cells and positions of a cache entry for up to n_frames frames, filled a block of frames at a
+    time and then completed with commit_trajectory. The positions are laid out atom by atom, so that a batch of
+    atoms is contiguous on disk, and returned as a view of shape (frames, atoms, 3). Without path the arrays are
+    kept in anonymous temporary files, removed by the system once released
+    """
+    if path is None:
+        cells = np.memmap(TemporaryFile(), np.float64, "w+", shape=(n_frames, 3, 3))
+        posis = np.memmap(TemporaryFile(), dtype, "w+", shape=(n_atoms, n_frames, 3))
+
+        return cells, posis.transpose(1, 0, 2)
+
+    folder, _ = _source(path)
+    os.makedirs(folder, exist_ok=True)
+    _drop_stale(folder)
+
+    root = join(folder, key)
+    cells = open_memmap(root + "_cells.tmp.npy", "w+", np.float64, (n_frames, 3, 3))
+    posis = open_memmap(root + "_posis.tmp.npy", "w+", dtype, (n_atoms, n_frames, 3))
+
+    return cells, posis.transpose(1, 0, 2)
+
+
+def commit_trajectory(
+    path: Union[str, List[str]],
+    key: str,
+    atoms: Dict[str, int],
+    cells: ndarray,
+    posis: ndarray,
+    n_frames: int,
+) -> None:
+    """
+    Complete the cache entry of create_trajectory once its first n_frames frames are written. The metadata, with
+    the identity of all the source files, is written last so that partial entries are never read
+    """
+    folder, stamp = _source(path)
+    root = join(folder, key)
+
+    for name, array in zip(["_cells", "_posis"], [cells, posis]):
+        array.flush()
+        os.replace(root + name + ".tmp.npy", root + name + ".npy")
+
+    with open(root + ".json.tmp", "w") as file:
+        json.dump(
+            {
+                "source": stamp,
+                "atoms": {k: int(n) for k, n in atoms.items()},
+                "order": "atoms",
+                "frames": int(n_frames),
+            },
+            file,
+        )
+    os.replace(root + ".json.tmp", root + ".json")
+
+
+def save_trajectory(
+    path: Union[str, List[str]],
+    key: str,
+    atoms: Dict[str, int],
+    cells: ndarray,
+    posis: ndarray,
+) -> None:
+    """
+    Store the processed trajectory in the cache of the source file, the first one for trajectories split in
+    segments, dropping the entries that refer to an older version of any of their files
+    """
+    stored_cells, stored_posis = create_trajectory(
+        path, key, cells.shape[0], posis.shape[1], posis.dtype
+    )
+    stored_cells[:], stored_posis[:] = cells, posis
+
+    commit_trajectory(path, key, atoms, stored_cells, stored_posis, cells.shape[0])
+
+
+def load_index(path: str) -> Optional[ndarray]:
+    """
+    Load the byte offsets of the frames of the source file, None if they were never stored or the file changed
+    """
+    root = join(cache_dir(path), cache_key(path, index=True))
+
+    if not isfile(root + ".json"):
+        return None
+
+    try:
+        return np.load(root + "_index.npy")
+    except (OSError, ValueError):
+        return None
+
+
+def save_index(path: str, offsets: ndarray) -> None:
+    """
+    Store the byte offsets of the frames in the cache of the source file, dropping the entries that refer to an
+    older version of it
+    """
+    folder = cache_dir(path)
+    os.makedirs(folder, exist_ok=True)
+
+    stamp = source_stamp(path)
+    _drop_stale(folder)
+
+    root = join(folder, cache_key(path, index=True))
+    np.save(root + "_index.tmp", np.asarray(offsets, dtype=np.int64))
+    os.replace(root + "_index.tmp.npy", root + "_index.npy")
+
+    with open(root + ".json.tmp", "w") as file:
+        json.dump({"source": stamp}, file)
+    os.replace(root + ".json.tmp", root + ".json")
+
+
+def cached_index(
+    path: str, scan: Callable[[str], ndarray], cache: bool = True
+) -> ndarray:
+    """
+    Byte offsets of the frames, or ionic steps, of the source file found by scan, stored next to the file after the
+    first scan so that the following runs can seek to any of them straight away. Without cache the file is always
+    scanned and nothing is written
+    """
+    offsets = load_index(path) if cache else None
+
+    if offsets is None:
+        offsets = scan(path)
+
+        if cache:
+            try:
+                save_index(path, offsets)
+            except OSError:
+                pass
+
+    return offsets
+
+
+class ResultCache:
+    """
+    Least recently used cache of analysis results, numpy arrays or tuples of them, bounded by the memory they
+    occupy and returned read only. If a folder is given the results are also stored on disk, so that they survive
+    to the process and are found again by the next sessions working on the same trajectory. With the source files
+    the stored results are stamped with their identity and removed once any of them changes
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 1 << 28,
+        folder: Optional[str] = None,
+        prefix: str = "",
+        source: Optional[Union[str, List[str]]] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.folder, self.prefix = folder, prefix
+
+        self.__stamp = None if source is None else _source(source)[1]
+
+        self.__entries: OrderedDict = OrderedDict()
+        self.__bytes = 0
+        self.__lock = Lock()
+
+    def __file(self, key: str) -> str:
+        return join(self.folder, f"{self.prefix}_{key}.npz")
+
+    @staticmethod
+    def key(*params) -> str:
+        """
+        Key of a result from the parameters identifying it
+        """
+        return sha1(json.dumps(params, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def __freeze(value):
+        """
+        Result with its arrays made read only, so that the callers sharing them cannot alter the cached values
+        """
+        if isinstance(value, tuple):
+            return tuple(ResultCache.__freeze(x) for x in value)
+
+        value = np.asarray(value)
+        value.flags.writeable = False
+
+        return value
+
+    @staticmethod
+    def __nbytes(value) -> int:
+        if isinstance(value, tuple):
+            return sum(np.asarray(x).nbytes for x in value)
+
+        return np.asarray(value).nbytes
+
+    def get(self, key: str):
+        """
+        Result stored with the key, looking on disk if it is not in memory, None if it was never stored. The arrays
+        are shared with the cache and so read only
+        """
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                return self.__entries[key]
+
+        if self.folder is None or not isfile(self.__file(key)):
+            return None
+
+        try:
+            with np.load(self.__file(key)) as data:
+                if "value" in data.files:
+                    value = data["value"]
+                else:
+                    value = tuple(data[f"arr_{i}"] for i in range(len(data.files)))
+        except (OSError, ValueError):
+            return None
+
+        value = self.__freeze(value)
+        self.__remember(key, value)
+
+        return value
+
+    def put(self, key: str, value) -> None:
+        """
+        Store a result, whose arrays become read only, evicting the least recently used ones beyond the memory bound
+        """
+        value = self.__freeze(value)
+        self.__remember(key, value)
+
+        if self.folder is None:
+            return
+
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+
+            # The first result of the source drops the ones of its older versions
+            stamp = join(self.folder, f"{self.prefix}_results.json")
+            if self.__stamp is not None and not isfile(stamp):
+                _drop_stale(self.folder)
+
+                with open(stamp + ".tmp", "w") as file:
+                    json.dump({"source": self.__stamp}, file)
+                os.replace(stamp + ".tmp", stamp)
+
+            with open(self.__file(key) + ".tmp", "wb") as file:
+                if isinstance(value, tuple):
+                    np.savez(file, *value)
+                else:
+                    np.savez(file, value=value)
+            os.replace(self.__file(key) + ".tmp", self.__file(key))
+        except OSError as err:
+            print(f"ResultCache: unable to store the result, {err}")
+
+    def clear(self) -> None:
+        """
+        Forget the results kept in memory, the ones on disk are left untouched
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def __remember(self, key: str, value) -> None:
+        size = self.__nbytes(value)
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__bytes -= self.__nbytes(self.__entries.pop(key))
+
+            # Results larger than the whole cache are not kept in memory
+            if size > self.max_bytes:
+                return
+
+            self.__entries[key] = value
+            self.__bytes += size
+
+            while self.__bytes > self.max_bytes:
+                _, old = self.__entries.popitem(last=False)
+                self.__bytes -= self.__nbytes(old)
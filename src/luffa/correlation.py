@@ -0,0 +1,509 @@
+"""Script with the FFT kernels used to compute MSDs and correlation functions of trajectories"""
+
+# ---- IMPORT
+
+# Numpy
+import numpy as np
+
+# Typing
+from typing import Optional
+from numpy import ndarray
+
+# Size in bytes of the buffer transformed at once, small enough to live in cache
+BATCH_BYTES = 1 << 22
+
+# Largest window for which summing the MSD directly is cheaper than the FFT over the
+# whole trajectory, measured on 2e4-1e5 frames where the two match at about 10 lags
+DIRECT_MAX_LAG = 8
+
+
+# ---- FUNCTION
+
+
+def next_fast_len(n: int) -> int:
+    """
+    Smallest integer not lower than n having only 2, 3 and 5 as prime factors, lengths for which the FFT is fastest
+    """
+    if n <= 1:
+        return 1
+
+    best = 1 << (n - 1).bit_length()
+
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            # Smallest power of two bringing p35 above n
+            p2 = 1 << (-(-n // p35) - 1).bit_length()
+
+            best = min(best, p2 * p35)
+            p35 *= 3
+        p5 *= 5
+
+    return best
+
+
+def _pair_sums(values: ndarray) -> ndarray:
+    """
+    Sums over the time origins of values(t) + values(t + k) for every lag k, from the cumulative sums of values
+    """
+    zeros = np.zeros((1,) + values.shape[1:])
+
+    return (
+        2 * values.sum(0)
+        - np.cumsum(np.append(zeros, values[:-1], 0), 0)
+        - np.cumsum(np.append(zeros, values[:0:-1], 0), 0)
+    )
+
+
+def _grouped_msd_sums(
+    atomic_positions: ndarray,
+    groups: Optional[ndarray],
+    n_groups: int,
+    batch_size: Optional[int],
+) -> ndarray:
+    """
+    Sums over the atoms of every group of the squared displacements at every lag, with shape (frames, groups, dims),
+    all the atoms forming a single group if groups is None.
+
+    The positions autocorrelation is obtained with a real FFT padded to a fast length, summing the power spectrum
+    of batch_size atoms at a time so that the same buffers are reused by all the batches. Single precision positions
+    are transformed in single precision, while all the sums are accumulated in double precision.
+    """
+    N, n_atoms, dims = atomic_positions.shape
+    L = next_fast_len(2 * N)
+
+    dtype = np.float32 if atomic_positions.dtype == np.float32 else np.float64
+
+    if batch_size is None:
+        batch_size = BATCH_BYTES // (L * dims * np.dtype(dtype).itemsize)
+    batch_size = min(max(batch_size, 1), n_atoms)
+
+    # Buffers shared by all the batches, the padding after the N frames stays zero
+    buffer = np.zeros((batch_size * dims, L), dtype=dtype)
+    squares = np.zeros((N, n_groups, dims))
+    power = np.zeros((L // 2 + 1, n_groups, dims))
+
+    for start in range(0, n_atoms, batch_size):
+        batch = np.asarray(atomic_positions[:, start : start + batch_size], np.float64)
+        b = batch.shape[1]
+
+        # Centering every atom on its mean position leaves the MSD unchanged but
+        # limits the cancellation between S1 and S2
+        batch = batch - batch.mean(0)
+
+        buffer[: b * dims, :N] = batch.reshape(N, b * dims).T
+        spectrum = np.fft.rfft(buffer[: b * dims], axis=-1)
+        spectrum = (np.square(spectrum.real) + np.square(spectrum.imag)).reshape(
+            b, dims, -1
+        )
+
+        if groups is None:
+            squares[:, 0] += np.square(batch).sum(1)
+            power[:, 0] += spectrum.sum(0).T
+        else:
+            # Atoms are summed into their groups through the one hot encoding of the groups
+            onehot = np.equal.outer(groups[start : start + b], np.arange(n_groups))
+            onehot = onehot.astype(np.float64)
+
+            squares += np.einsum("tad,ag->tgd", np.square(batch), onehot)
+            power += np.einsum("adf,ag->fgd", spectrum, onehot)
+
+    # S1(k) = sum_t r(t)^2 + r(t + k)^2 and S2(k) = sum_t r(t) r(t + k) from the power spectrum
+    S1 = _pair_sums(squares)
+    S2 = np.fft.irfft(power, L, axis=0)[:N]
+
+    return S1 - 2 * S2
+
+
+def fft_msd(atomic_positions: ndarray, batch_size: Optional[int] = None) -> ndarray:
+    """
+    Computes the MSD averaged over the atoms of a trajectory of shape (frames, atoms, dims) with the FFT algorithm,
+    returning an array of shape (frames, dims).
+
+    The positions autocorrelation is obtained with a real FFT padded to a fast length, transforming batch_size atoms
+    at a time, in single precision for single precision positions, while all the sums are accumulated in double
+    precision.
+    """
+    N, n_atoms, _ = atomic_positions.shape
+
+    msd = _grouped_msd_sums(atomic_positions, None, 1, batch_size)[:, 0]
+
+    return msd / ((N - np.arange(N)).reshape(N, 1) * n_atoms)
+
+
+def grouped_fft_msd(
+    atomic_positions: ndarray,
+    groups: ndarray,
+    n_groups: Optional[int] = None,
+    batch_size: Optional[int] = None,
+) -> ndarray:
+    """
+    Computes with the FFT algorithm the MSD averaged over the atoms of every group of a trajectory of shape
+    (frames, atoms, dims), where groups gives the group of every atom. Returns an array of shape
+    (groups, frames, dims).
+
+    Atoms are transformed in batches as in fft_msd, and the power spectra of every batch are summed into
+    the ones of their groups, so any number of groups costs a single pass of FFTs.
+    """
+    N = atomic_positions.shape[0]
+
+    groups = np.asarray(groups)
+    if n_groups is None:
+        n_groups = groups.max() + 1
+
+    counts = np.bincount(groups, minlength=n_groups)
+
+    msd = _grouped_msd_sums(atomic_positions, groups, n_groups, batch_size)
+    norm = (N - np.arange(N)).reshape(N, 1, 1) * counts.reshape(1, -1, 1)
+
+    return (msd / np.maximum(norm, 1)).transpose(1, 0, 2)
+
+
+def fft_autocorrelation(
+    series: ndarray,
+    weights: Optional[ndarray] = None,
+    batch_size: Optional[int] = None,
+) -> ndarray:
+    """
+    Computes the autocorrelation <x(t) x(t + k)> of a series of shape (frames, atoms, dims), averaged over the time
+    origins and over the atoms, optionally weighted, returning an array of shape (frames, dims).
+
+    The correlation comes from the power spectrum (Wiener-Khinchin) of the zero padded series, summed over
+    batch_size atoms at a time before a single inverse transform as in fft_msd.
+    """
+    N, n_atoms, dims = series.shape
+    L = next_fast_len(2 * N)
+
+    if weights is None:
+        weights = np.ones(n_atoms)
+    weights = np.asarray(weights, np.float64)
+
+    if batch_size is None:
+        batch_size = BATCH_BYTES // (L * dims * 8)
+    batch_size = min(max(batch_size, 1), n_atoms)
+
+    buffer = np.zeros((batch_size * dims, L))
+    power = np.zeros((L // 2 + 1, dims))
+
+    for start in range(0, n_atoms, batch_size):
+        batch = np.asarray(series[:, start : start + batch_size], np.float64)
+        m = batch.shape[1] * dims
+
+        buffer[:m, :N] = batch.reshape(N, m).T
+        spectrum = np.fft.rfft(buffer[:m], axis=-1)
+
+        power += np.einsum(
+            "adf,a->fd",
+            (np.square(spectrum.real) + np.square(spectrum.imag)).reshape(
+                -1, dims, L // 2 + 1
+            ),
+            weights[start : start + batch_size],
+        )
+
+    return np.fft.irfft(power, L, axis=0)[:N] / (
+        (N - np.arange(N)).reshape(N, 1) * weights.sum()
+    )
+
+
+def fft_displacement_moments(
+    atomic_positions: ndarray, batch_size: Optional[int] = None
+) -> tuple[ndarray, ndarray]:
+    """
+    Computes with the FFT algorithm the second and fourth moments of the displacements, <|dr|^2> and <|dr|^4>,
+    averaged over the atoms of a trajectory of shape (frames, atoms, dims), returning two arrays of shape (frames,).
+
+    With a = r(t), b = r(t + k), A = |a|^2 and B = |b|^2 the fourth power expands as
+        |b - a|^4 = A^2 + B^2 + 2AB - 4(A + B)(a.b) + 4(a.b)^2
+    where the first two terms come from cumulative sums and the others from the correlations of |r|^2, |r|^2 r_i,
+    r_i and r_i r_j, all transformed in the same batched FFT as in fft_msd.
+    """
+    N, n_atoms, dims = atomic_positions.shape
+    L = next_fast_len(2 * N)
+
+    # Products r_i r_j with i <= j, the ones with i != j appear twice in (a.b)^2
+    iu, ju = np.triu_indices(dims)
+    weights = np.where(iu == ju, 1.0, 2.0).reshape(-1, 1)
+
+    # Series of every atom: r_i, |r|^2, |r|^2 r_i and r_i r_j
+    n_series = 2 * dims + 1 + len(iu)
+
+    if batch_size is None:
+        batch_size = BATCH_BYTES // (L * n_series * 8)
+    batch_size = min(max(batch_size, 1), n_atoms)
+
+    buffer = np.zeros((batch_size * n_series, L))
+    squares, quartics = np.zeros(N), np.zeros(N)
+    power2, power4 = np.zeros(L // 2 + 1), np.zeros(L // 2 + 1)
+
+    for start in range(0, n_atoms, batch_size):
+        batch = np.asarray(atomic_positions[:, start : start + batch_size], np.float64)
+        b = batch.shape[1]
+
+        # Centering leaves the displacements unchanged but limits the cancellations
+        batch = batch - batch.mean(0)
+        A = np.square(batch).sum(-1)
+
+        squares += A.sum(1)
+        quartics += np.square(A).sum(1)
+
+        series = np.concatenate(
+            [
+                batch,
+                A[..., np.newaxis],
+                A[..., np.newaxis] * batch,
+                batch[..., iu] * batch[..., ju],
+            ],
+            axis=-1,
+        )
+
+        buffer[: b * n_series, :N] = series.reshape(N, b * n_series).T
+        F = np.fft.rfft(buffer[: b * n_series], axis=-1).reshape(b, n_series, -1)
+
+        Fx, FA = F[:, :dims], F[:, dims]
+        FAx, Fxx = F[:, dims + 1 : 2 * dims + 1], F[:, 2 * dims + 1 :]
+
+        power2 += (np.square(Fx.real) + np.square(Fx.imag)).sum((0, 1))
+        power4 += (
+            2 * (np.square(FA.real) + np.square(FA.imag)).sum(0)
+            - 8 * (FAx.real * Fx.real + FAx.imag * Fx.imag).sum((0, 1))
+            + 4 * (weights * (np.square(Fxx.real) + np.square(Fxx.imag))).sum((0, 1))
+        )
+
+    norm = (N - np.arange(N)) * n_atoms
+
+    r2 = (_pair_sums(squares) - 2 * np.fft.irfft(power2, L)[:N]) / norm
+    r4 = (_pair_sums(quartics) + np.fft.irfft(power4, L)[:N]) / norm
+
+    return r2, r4
+
+
+def van_hove_self(
+    atomic_positions: ndarray,
+    lags: ndarray,
+    r_max: float,
+    nbins: int = 200,
+    stride: int = 1,
+    chunk: Optional[int] = None,
+) -> tuple[ndarray, ndarray]:
+    """
+    Self part of the Van Hove function G_s(r, t) of a trajectory of shape (frames, atoms, 3) at the given lags,
+    in frames, as histograms of the displacement lengths over nbins bins up to r_max, taking one time origin every
+    stride. Returns the bin centres and G_s with shape (lags, nbins), normalized so that the integral of
+    4 pi r^2 G_s(r, t) is one.
+
+    The displacements are binned chunk origins at a time, keeping the memory bounded for any trajectory length.
+    """
+    N, n_atoms, dims = atomic_positions.shape
+    lags = np.atleast_1d(lags)
+
+    if chunk is None:
+        chunk = max(BATCH_BYTES // (n_atoms * dims * 8), 1)
+
+    dr = r_max / nbins
+    counts = np.zeros((len(lags), nbins))
+    totals = np.zeros(len(lags))
+
+    for i, k in enumerate(lags):
+        for start in range(0, N - k, chunk * stride):
+            stop = min(start + chunk * stride, N - k)
+
+            d = np.asarray(
+                atomic_positions[start + k : stop + k : stride], np.float64
+            ) - np.asarray(atomic_positions[start:stop:stride], np.float64)
+
+            index = (np.sqrt(np.einsum("...i,...i", d, d)) / dr).astype(np.int64)
+
+            counts[i] += np.bincount(index[index < nbins], minlength=nbins)
+            totals[i] += index.size
+
+    edges = dr * np.arange(nbins + 1)
+    shells = 4 / 3 * np.pi * np.diff(edges**3)
+
+    return 0.5 * (edges[1:] + edges[:-1]), counts / (
+        np.maximum(totals, 1).reshape(-1, 1) * shells
+    )
+
+
+def fft_cross_msd(series: ndarray) -> ndarray:
+    """
+    Computes with the FFT algorithm the cross MSDs <dx_a(k) . dx_b(k)> between all the pairs of the groups of a
+    series of shape (frames, groups, dims), such as the summed positions of every species, returning an array of
+    shape (groups, groups, frames, dims), with the MSD of every group on the diagonal.
+
+    Every group is transformed only once, the pairs coming from the products of the spectra.
+    """
+    N, n_groups, dims = series.shape
+    L = next_fast_len(2 * N)
+
+    series = np.asarray(series, np.float64)
+    series = series - series.mean(0)
+
+    spectrum = np.fft.rfft(series, L, axis=0)
+
+    # C_ab(k) + C_ba(k) with C_ab(k) = sum_t x_a(t) x_b(t + k)
+    cross = np.einsum("fad,fbd->abfd", spectrum.conjugate(), spectrum)
+    C = np.fft.irfft(2 * cross.real, L, axis=2)[:, :, :N]
+
+    # S1_ab(k) = sum_t x_a(t) x_b(t) + x_a(t + k) x_b(t + k)
+    products = np.einsum("tad,tbd->tabd", series, series)
+    S1 = np.moveaxis(_pair_sums(products), 0, 2)
+
+    return (S1 - C) / (N - np.arange(N)).reshape(1, 1, N, 1)
+
+
+def direct_msd(atomic_positions: ndarray, max_lag: int) -> ndarray:
+    """
+    Sum over the atoms of the MSD of the first max_lag lags, computed directly lag by lag with a cost frames x max_lag
+    """
+    N, _, dims = atomic_positions.shape
+
+    msd = np.zeros((max_lag, dims))
+    for k in range(1, max_lag):
+        d = atomic_positions[k:] - atomic_positions[:-k]
+
+        msd[k] = np.einsum("ijk,ijk->k", d, d) / (N - k)
+
+    return msd
+
+
+def windowed_msd(
+    atomic_positions: ndarray, max_lag: int, batch_size: Optional[int] = None
+) -> ndarray:
+    """
+    Computes the MSD averaged over the atoms of a trajectory of shape (frames, atoms, dims) only for the first max_lag
+    lags, returning an array of shape (max_lag, dims).
+
+    Short windows are summed directly, with a cost linear in the window, while longer ones are cut from the full
+    fft_msd, whose cost does not depend on the window. Atoms are processed in batches so that the memory does not
+    grow with the number of atoms.
+    """
+    N, n_atoms, dims = atomic_positions.shape
+    max_lag = min(max_lag, N)
+
+    if max_lag > DIRECT_MAX_LAG:
+        return fft_msd(atomic_positions, batch_size)[:max_lag]
+
+    if batch_size is None:
+        batch_size = BATCH_BYTES // (N * dims * 8)
+    batch_size = min(max(batch_size, 1), n_atoms)
+
+    msd = np.zeros((max_lag, dims))
+    for start in range(0, n_atoms, batch_size):
+        batch = np.asarray(atomic_positions[:, start : start + batch_size], np.float64)
+
+        msd += direct_msd(batch - batch.mean(0), max_lag)
+
+    return msd / n_atoms
+
+
+class MultiTauMSD:
+    """
+    Multiple-tau correlator computing the MSD on a logarithmic grid of lags in a single pass over the frames, which
+    are consumed one at a time keeping in memory only points frames per level, so O(log N) positions per atom.
+
+    Level l keeps one frame every base^l and correlates every new one with the previous points - 1 frames, giving
+    the lags j base^l, where for l > 0 only j >= points / base is used since the shorter lags are already covered
+    by the finer levels.
+    """
+
+    def __init__(
+        self,
+        n_atoms: int,
+        dims: int = 3,
+        points: int = 16,
+        base: int = 2,
+        max_lag: Optional[int] = None,
+    ) -> None:
+        self.n_atoms, self.dims = n_atoms, dims
+        self.points, self.base = points, base
+        self.max_lag = max_lag
+
+        self.__lags = np.arange(points)
+
+        # Ring buffer, frames received, sum of the squared displacements and number of them for every level
+        self.__buffers: list[ndarray] = []
+        self.__counts: list[int] = []
+        self.__sums: list[ndarray] = []
+        self.__norms: list[ndarray] = []
+
+    def __first_lag(self, level: int) -> int:
+        return 1 if level == 0 else self.points // self.base
+
+    def update(self, frame: ndarray) -> None:
+        """
+        Consume a new frame of shape (atoms, dims)
+        """
+        frame = np.asarray(frame, np.float64)
+
+        level = 0
+        while True:
+            if level == len(self.__buffers):
+                self.__buffers.append(np.zeros((self.points, self.n_atoms, self.dims)))
+                self.__counts.append(0)
+                self.__sums.append(np.zeros((self.points, self.dims)))
+                self.__norms.append(np.zeros(self.points))
+
+            buffer, n = self.__buffers[level], self.__counts[level]
+
+            # Correlate with the frames stored in the ring buffer
+            lags = self.__lags[self.__first_lag(level) : min(n, self.points - 1) + 1]
+            if len(lags) > 0:
+                d = frame - buffer[(n - lags) % self.points]
+
+                self.__sums[level][lags] += np.einsum("ijk,ijk->ik", d, d)
+                self.__norms[level][lags] += 1
+
+            buffer[n % self.points] = frame
+            self.__counts[level] = n + 1
+
+            # Only one frame every base is passed to the coarser level
+            if (n + 1) % self.base != 0:
+                break
+
+            level += 1
+
+            if self.max_lag is not None and (
+                self.__first_lag(level) * self.base**level > self.max_lag
+            ):
+                break
+
+    def result(self) -> tuple[ndarray, ndarray]:
+        """
+        Lags, in frames, and MSD averaged over the atoms with shape (lags, dims) of the frames consumed so far
+        """
+        lags, msd = [np.zeros(1, dtype=int)], [np.zeros((1, self.dims))]
+
+        for level, (sums, norms) in enumerate(zip(self.__sums, self.__norms)):
+            j = np.arange(self.__first_lag(level), self.points)
+            j = j[norms[j] > 0]
+
+            lags.append(j * self.base**level)
+            msd.append(sums[j] / (norms[j] * self.n_atoms).reshape(-1, 1))
+
+        lags, msd = np.concatenate(lags), np.concatenate(msd)
+
+        if self.max_lag is not None:
+            lags, msd = lags[lags < self.max_lag], msd[lags < self.max_lag]
+
+        return lags, msd
+
+
+def multitau_msd(
+    atomic_positions: ndarray,
+    points: int = 16,
+    base: int = 2,
+    max_lag: Optional[int] = None,
+) -> tuple[ndarray, ndarray]:
+    """
+    Computes the MSD of a trajectory of shape (frames, atoms, dims) on a logarithmic grid of lags with the
+    multiple-tau correlator, reading one frame at a time so that it can be used on memory mapped positions.
+    Returns the lags, in frames, and the MSD averaged over the atoms with shape (lags, dims)
+    """
+    _, n_atoms, dims = atomic_positions.shape
+
+    correlator = MultiTauMSD(n_atoms, dims, points, base, max_lag)
+    for frame in atomic_positions:
+        correlator.update(frame)
+
+    return correlator.result()
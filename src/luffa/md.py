@@ -12,16 +12,68 @@
 #
 #     fori_loop = None
 
+# Physical constants in SI units
+ELEMENTARY_CHARGE = 1.602176634e-19  # C
+BOLTZMANN = 1.380649e-23  # J/K
+
+# Frames parsed at once when iterating over a lazy trajectory
+LAZY_BLOCK = 1024
+
 import numpy as np
 from numpy import ndarray as Array
 
-from numpy import loadtxt, ndarray
+from numpy import ndarray
+from numpy.typing import DTypeLike
 
 # PLOTTING
 import matplotlib.pyplot as plt
 from matplotlib.axes import Axes
 
+# XDATCAR
+from .xdatcar import (
+    parse_xdatcar,
+    read_species,
+    is_coordinate_direct,
+    find_overlap,
+    frame_offsets,
+    write_xdatcar,
+)
+
+# KERNELS
+from .correlation import (
+    fft_autocorrelation,
+    fft_cross_msd,
+    fft_msd,
+    fft_displacement_moments,
+    grouped_fft_msd,
+    multitau_msd,
+    next_fast_len,
+    van_hove_self,
+    windowed_msd,
+)
+
+# STRUCTURE
+from .rdf import radial_distribution
+
+# CACHE
+from .cache import (
+    ResultCache,
+    cache_dir,
+    cache_key,
+    commit_trajectory,
+    create_trajectory,
+    load_trajectory,
+    save_trajectory,
+)
+
 # MISCELLANEUS
+from os import cpu_count
+from os.path import isfile
+from glob import glob
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from threading import Lock
 from tqdm import tqdm
 from typing import Optional
 
@@ -34,24 +86,147 @@ class VaspMDAnalyzer:
     __atoms: dict[str, int]
     __potim: float  # fs
 
-    __msd: dict = dict()
-    __D: dict = dict()
+    # Loader of the trajectory, set only in lazy mode until the processed
+    # trajectory is needed
+    __pending = None
+    __loading: Lock
+
+    # Frames offsets of the XDATCAR and last block of raw frames read from it
+    __offsets: Optional[Array] = None
+    __raw_block: Optional[tuple[int, Array, Array]] = None
+
+    # Results of the analyses computed on this trajectory
+    __results: ResultCache
+    __identity: str
+
+    # Memory (MB) within which the trajectory is processed and analysed
+    __memory_budget: Optional[float]
 
     def __init__(
         self,
-        trajectory_path: str = "./XDATCAR",
+        trajectory_path: str | list[str] = "./XDATCAR",
         potim: float = 1,
         start_conf: int = 0,
         nconf: Optional[int] = None,
         jump_elimination: bool = True,
+        cache: bool = True,
+        dtype: DTypeLike = np.float64,
+        lazy: bool = False,
+        results_memory: float = 256,
+        store_results: bool = False,
+        memory_budget: Optional[float] = None,
     ) -> None:
         # Save potim
         self.__potim = potim
 
+        # With a memory budget (MB) the XDATCAR is processed in blocks of frames
+        # stored on disk, and the MSDs stream the atoms from there by default
+        self.__memory_budget = memory_budget
+
+        # A trajectory split in segments is given as a list or a glob of files
+        paths = self.__resolve_paths(trajectory_path)
+        trajectory_path = paths[0] if len(paths) == 1 else paths
+
+        found = all(isfile(x) for x in paths)
+
+        # Identity of the processed trajectory, used to key its cache and results
+        params = dict(
+            start_conf=start_conf,
+            nconf=nconf,
+            jump_elimination=jump_elimination,
+            dtype=np.dtype(dtype).name,
+        )
+
+        if found:
+            self.__identity = cache_key(trajectory_path, **params)
+        else:
+            self.__identity = ResultCache.key(trajectory_path, params)
+
+        # Results are kept in memory up to results_memory MB, and optionally
+        # stored next to the trajectory for the following sessions
+        self.__results = ResultCache(
+            int(results_memory * 2**20),
+            cache_dir(paths[0]) if store_results and found else None,
+            self.__identity,
+            trajectory_path if found else None,
+        )
+
+        # Raw frames, as written in the XDATCAR, are read straight from the file
+        # seeking with the frames offsets, found when first needed
+        self.__source = trajectory_path, start_conf, nconf, cache
+        self.__dtype = np.dtype(dtype)
+
+        # Lazily only the header and the frames offsets are read, and the trajectory
+        # is processed once an analysis, or a processed frame, needs it
+        self.__loading = Lock()
+        if lazy:
+            try:
+                self.__open_raw()
+            except Exception:
+                lazy = False
+
+        load = partial(
+            self.__load,
+            trajectory_path,
+            start_conf,
+            nconf,
+            jump_elimination,
+            cache,
+            dtype,
+        )
+
+        if lazy:
+            self.__pending = load
+        else:
+            load()
+
+    def __load(
+        self,
+        trajectory_path: str | list[str],
+        start_conf: int,
+        nconf: Optional[int],
+        jump_elimination: bool,
+        cache: bool,
+        dtype: DTypeLike,
+    ) -> None:
+        paths = (
+            [trajectory_path] if isinstance(trajectory_path, str) else trajectory_path
+        )
+
+        # Look for an already processed version of the trajectory, for segmented
+        # trajectories stored next to the first segment
+        cache = cache and all(isfile(x) for x in paths)
+        if cache:
+            key = self.__identity
+
+            if self.__read_cache(trajectory_path, key):
+                return
+
         # Try to read it as an XDATCAR
         try:
-            self.__read_xdatcar(trajectory_path, start_conf, nconf, jump_elimination)
+            if len(paths) > 1:
+                self.__read_segments(paths, start_conf, nconf, jump_elimination)
+            elif self.__memory_budget is not None:
+                self.__stream_xdatcar(
+                    trajectory_path,
+                    start_conf,
+                    nconf,
+                    jump_elimination,
+                    dtype,
+                    key if cache else None,
+                )
+
+                # Already stored block by block
+                return
+            else:
+                self.__read_xdatcar(
+                    trajectory_path, start_conf, nconf, jump_elimination, cache
+                )
         except Exception:
+            # Segments can only be XDATCAR files
+            if len(paths) > 1:
+                raise
+
             # If not work use ASE
             from ase.io import read
 
@@ -89,16 +264,28 @@ class VaspMDAnalyzer:
 
             print("VaspMDAnalyzer: Trajectory read succesfully!")
 
+        # Positions are processed in double precision and stored in the wanted one
+        self.__atoms_posis = self.__atoms_posis.astype(dtype, copy=False)
+
+        # Store the processed trajectory for the next runs
+        if cache:
+            self.__write_cache(trajectory_path, key)
+
     def get_total_frame(self) -> int:
+        if self.__pending is not None:
+            return len(self.__offsets)
+
         return self.__atoms_posis.shape[0]
 
     def get_atomic_species(self) -> list[str]:
         return list(self.__atoms.keys())
 
     def get_atomic_symbols(self) -> list[str]:
-        return self.get_atoms_from_frame(0).get_chemical_symbols()
+        return self.__get_symbols()
 
     def get_atomic_position(self, element: str | None = None) -> Array:
+        self.__load_pending()
+
         if element is None:
             return self.__atoms_posis
 
@@ -119,12 +306,19 @@ class VaspMDAnalyzer:
         ax: Axes | None = None,
         scale: str | None = None,
         show: bool = False,
+        method: str = "fft",
+        max_lag: Optional[int] = None,
     ) -> None:
         if ax is None:
             ax = plt.subplot()
 
-        y = self.get_MSD(element, method="lax")
-        x = self.__potim * np.arange(y.shape[0])
+        y = self.get_MSD(element, method=method, max_lag=max_lag)
+
+        # The multiple-tau MSD comes with its own lags
+        if isinstance(y, tuple):
+            x, y = self.__potim * y[0], y[1]
+        else:
+            x = self.__potim * np.arange(y.shape[0])
 
         ax.plot(x, y[:, 0], "--", label="X-component", color="darkcyan")
         ax.plot(x, y[:, 1], "-.", label="Y-component", color="slateblue")
@@ -145,73 +339,503 @@ class VaspMDAnalyzer:
         if show:
             plt.show()
 
-    def get_structure_from_frame(self, frame: int):
+    def get_structure_from_frame(self, frame: int, raw: bool = False):
         from pymatgen.core import Structure, Lattice
 
-        symbols = []
-        for element, n in self.__atoms.items():
-            for _ in range(n):
-                symbols.append(element)
+        cell, posis = self.__get_frame(frame, raw)
 
         return Structure(
-            Lattice(self.__cells[frame]),
-            symbols,
-            self.__atoms_posis[frame],
+            Lattice(cell),
+            self.__get_symbols(),
+            posis,
             coords_are_cartesian=True,
         )
 
-    def get_atoms_from_frame(self, frame: int):
+    def get_atoms_from_frame(self, frame: int, raw: bool = False):
+        """
+        Positions are unwrapped and without drift, processing the trajectory if lazy, or with
+        raw the ones of the XDATCAR, wrapped in the cell and with the drift, read from the file
+        """
         from ase import Atoms
 
-        symbols = []
-        for element, n in self.__atoms.items():
-            for _ in range(n):
-                symbols.append(element)
+        cell, posis = self.__get_frame(frame, raw)
 
         return Atoms(
-            symbols,
-            positions=self.__atoms_posis[frame],
-            cell=self.__cells[frame],
+            self.__get_symbols(),
+            positions=posis,
+            cell=cell,
             pbc=True,
         )
 
-    def get_diffusion_coefficient(self, element: str):
-        msd = self.get_MSD(element, method="fft")
+    def iter_structures(
+        self,
+        start: int = 0,
+        stop: Optional[int] = None,
+        stride: int = 1,
+        raw: bool = False,
+    ):
+        from pymatgen.core import Structure, Lattice
+
+        # Species are resolved once for all the frames
+        symbols = self.__get_symbols()
+
+        for cell, posis in self.__iter_frames(start, stop, stride, raw):
+            yield Structure(Lattice(cell), symbols, posis, coords_are_cartesian=True)
+
+    def iter_atoms(
+        self,
+        start: int = 0,
+        stop: Optional[int] = None,
+        stride: int = 1,
+        raw: bool = False,
+    ):
+        from ase import Atoms
+        from ase.data import atomic_numbers
+
+        # Atomic numbers are resolved once for all the frames
+        numbers = np.array([atomic_numbers[x] for x in self.__get_symbols()])
+
+        for cell, posis in self.__iter_frames(start, stop, stride, raw):
+            yield Atoms(numbers=numbers, positions=posis, cell=cell, pbc=True)
+
+    def write_extxyz(
+        self,
+        path: str,
+        start: int = 0,
+        stop: Optional[int] = None,
+        stride: int = 1,
+        append: bool = False,
+        raw: bool = False,
+    ) -> None:
+        """
+        Positions are written as returned by get_atoms_from_frame
+        """
+        symbols = self.__get_symbols()
+
+        # The symbols are part of the format, so every frame is formatted at once
+        head = f"{len(symbols)}\n"
+        head += 'Lattice="' + " ".join(["%.8f"] * 9) + '" '
+        head += 'Properties=species:S:1:pos:R:3 frame=%d pbc="T T T"\n'
+        body = "".join(f"{x:<2s} %16.8f %16.8f %16.8f\n" for x in symbols)
+
+        frames = range(self.get_total_frame())[start:stop:stride]
+
+        with open(path, "a" if append else "w") as file:
+            for frame, (cell, posis) in tqdm(
+                zip(frames, self.__iter_frames(start, stop, stride, raw)),
+                total=len(frames),
+            ):
+                file.write(head % (*np.ravel(cell), frame))
+                file.write(body % tuple(np.ravel(posis)))
+
+    def get_diffusion_coefficient(self, element: str, recompute: bool = False):
+        key = self.__results.key(self.__identity, "D", element, self.__potim)
+
+        D = None if recompute else self.__results.get(key)
+        if D is not None:
+            return D
+
+        msd = self.get_MSD(element, method="fft", recompute=recompute)
 
         D = (np.roll(msd, -1, 0) - np.roll(msd, 1, 0)) / (2 * self.__potim)
 
-        if element is not None:
-            self.__D[element] = D
+        self.__results.put(key, D)
 
         return D
 
+    def get_diffusion_blocks(
+        self,
+        elements: Optional[list[str]] = None,
+        n_blocks: int = 5,
+        fit_start: float = 0.1,
+        fit_end: float = 0.5,
+        recompute: bool = False,
+    ) -> tuple[Array, Array]:
+        if elements is None:
+            elements = self.get_atomic_species()
+
+        # At least two blocks for the standard error and two frames per block for the fit
+        if not 2 <= n_blocks <= self.get_total_frame() // 2:
+            raise ValueError(
+                f"n_blocks must be between 2 and {self.get_total_frame() // 2} for {self.get_total_frame()} frames, got {n_blocks}"
+            )
+
+        key = self.__results.key(
+            self.__identity,
+            "D_blocks",
+            elements,
+            n_blocks,
+            fit_start,
+            fit_end,
+            self.__potim,
+        )
+
+        result = None if recompute else self.__results.get(key)
+        if result is not None:
+            return result
+
+        # Atoms of the wanted species together with the index of their species
+        posis = np.concatenate([self.get_atomic_position(x) for x in elements], 1)
+        species = np.repeat(
+            np.arange(len(elements)),
+            [self.get_atomic_position(x).shape[1] for x in elements],
+        )
+
+        # The trajectory is cut in blocks that are stacked as different atoms,
+        # computing the MSD of every block and species with a single FFT pass
+        N = self.get_total_frame() // n_blocks
+        n_atoms = posis.shape[1]
+
+        posis = posis[: n_blocks * N].reshape(n_blocks, N, n_atoms, 3)
+        posis = posis.transpose(1, 0, 2, 3).reshape(N, n_blocks * n_atoms, 3)
+
+        groups = (np.arange(n_blocks).reshape(-1, 1) * len(elements) + species).ravel()
+        msd = grouped_fft_msd(posis, groups, n_blocks * len(elements))
+        msd = np.append(msd, msd.sum(-1, keepdims=True), -1)
+
+        # MSD = 2 d D t + c fitted for every block, species and component at once
+        begin = int(fit_start * N)
+        end = max(int(fit_end * N), begin + 2)
+
+        time = self.__potim * np.arange(begin, end)
+        A = np.stack([time, np.ones_like(time)], axis=1)
+
+        slope = np.linalg.lstsq(
+            A, msd[:, begin:end].transpose(1, 0, 2).reshape(end - begin, -1), rcond=None
+        )[0][0]
+
+        # D[A²/fs] for the x, y, z components and the total
+        D = slope.reshape(n_blocks, len(elements), 4) / np.array([2, 2, 2, 6])
+
+        result = D.mean(0), D.std(0, ddof=1) / np.sqrt(n_blocks)
+        self.__results.put(key, result)
+
+        return result
+
     def get_MSD(
-        self, element: str, method: str = "fft", recompute: bool = False
-    ) -> Array:
-        if element in self.__msd.keys() and not recompute:
-            return self.__msd[element]
+        self,
+        element: str,
+        method: str = "fft",
+        recompute: bool = False,
+        memory_budget: Optional[float] = None,
+        max_lag: Optional[int] = None,
+    ) -> Array | tuple[Array, Array]:
+        method = method.strip().lower()
+        key = self.__results.key(self.__identity, "msd", element, method, max_lag)
+
+        if not recompute:
+            msd = self.__results.get(key)
+            if msd is not None:
+                return msd
+
+            # A window of an already computed full MSD is a truncation of it
+            if max_lag is not None and method != "multitau":
+                msd = self.__results.get(
+                    self.__results.key(self.__identity, "msd", element, method, None)
+                )
+                if msd is not None:
+                    return msd[:max_lag]
+
+        # The multiple-tau correlator streams the frames and returns its own lags
+        if method == "multitau":
+            msd = self.multitau_msd(self.get_atomic_position(element), max_lag)
+            self.__results.put(key, msd)
+
+            return msd
 
         # Possible errors in element selection are handled here
         msd = self.get_atomic_position(element)
 
-        if method.strip().lower() == "base":
-            msd = self.vectorized_msd(msd)
-        elif method.strip().lower() == "lax":
-            msd = self.lax_msd(msd)
-        elif method.strip().lower() == "fft":
-            msd = self.fft_msd(msd)
-        elif method.strip().lower() == "fft_lax":
-            msd = self.fft_lax_msd(msd)
+        if method == "base":
+            kernel = self.vectorized_msd
+        elif method == "lax":
+            kernel = self.lax_msd
+        elif method == "fft" and max_lag is not None:
+            kernel = partial(self.windowed_msd, max_lag=max_lag)
+        elif method == "fft":
+            kernel = self.fft_msd
+        elif method == "fft_lax":
+            kernel = self.fft_lax_msd
         else:
             raise NotImplementedError(
                 f"The method {method} selected is not implemented"
             )
 
-        if element is not None:
-            self.__msd[element] = msd
+        # With a memory budget (MB) the atoms are streamed in batches
+        if memory_budget is None:
+            memory_budget = self.__memory_budget
+
+        if memory_budget is None:
+            msd = kernel(msd)
+        else:
+            msd = self.streamed_msd(
+                msd, kernel, self.msd_batch_size(msd.shape[0], memory_budget)
+            )
+
+        msd = msd[:max_lag]
+        self.__results.put(key, msd)
 
         return msd
 
+    def get_non_gaussian(self, element: str, recompute: bool = False) -> Array:
+        key = self.__results.key(self.__identity, "alpha2", element)
+
+        alpha = None if recompute else self.__results.get(key)
+        if alpha is not None:
+            return alpha
+
+        r2, r4 = fft_displacement_moments(self.get_atomic_position(element))
+
+        # alpha_2 = 3 <dr^4> / (5 <dr^2>^2) - 1, zero for a gaussian displacement
+        alpha = np.zeros_like(r2)
+        alpha[1:] = 3 * r4[1:] / (5 * np.square(r2[1:])) - 1
+
+        self.__results.put(key, alpha)
+
+        return alpha
+
+    def get_van_hove(
+        self,
+        element: str,
+        lags: list[int],
+        r_max: float = 10,
+        nbins: int = 200,
+        stride: int = 1,
+        recompute: bool = False,
+    ) -> tuple[Array, Array]:
+        key = self.__results.key(
+            self.__identity, "van_hove", element, list(lags), r_max, nbins, stride
+        )
+
+        result = None if recompute else self.__results.get(key)
+        if result is not None:
+            return result
+
+        result = van_hove_self(
+            self.get_atomic_position(element), np.asarray(lags), r_max, nbins, stride
+        )
+        self.__results.put(key, result)
+
+        return result
+
+    def get_VACF(
+        self,
+        element: str | None = None,
+        mass_weighted: bool = False,
+        recompute: bool = False,
+    ) -> Array:
+        key = self.__results.key(
+            self.__identity, "vacf", element, mass_weighted, self.__potim
+        )
+
+        vacf = None if recompute else self.__results.get(key)
+        if vacf is not None:
+            return vacf
+
+        # Velocities (A/fs) by finite differences of the unwrapped positions
+        velocities = np.diff(self.get_atomic_position(element), axis=0) / self.__potim
+
+        weights = None
+        if mass_weighted:
+            from ase.data import atomic_masses, atomic_numbers
+
+            weights = np.repeat(
+                [atomic_masses[atomic_numbers[x]] for x in self.__atoms.keys()],
+                list(self.__atoms.values()),
+            )
+
+            if element is not None:
+                weights = weights[np.array(self.__get_symbols()) == element.strip()]
+
+        vacf = fft_autocorrelation(velocities, weights)
+        self.__results.put(key, vacf)
+
+        return vacf
+
+    def get_VDOS(
+        self,
+        element: str | None = None,
+        mass_weighted: bool = False,
+        window: str | None = "hann",
+        max_lag: Optional[int] = None,
+    ) -> tuple[Array, Array]:
+        vacf = self.get_VACF(element, mass_weighted)[:max_lag]
+        M = vacf.shape[0]
+
+        # The VACF is damped to zero at max_lag to reduce the leakage
+        if window is not None:
+            windows = {"hann": np.hanning, "blackman": np.blackman}
+
+            if window not in windows:
+                raise NotImplementedError(f"The window {window} is not implemented")
+
+            vacf = vacf * windows[window](2 * M - 1)[M - 1 :].reshape(M, 1)
+
+        # Cosine transform of the even VACF, frequencies in THz
+        n = next_fast_len(2 * M)
+        vdos = self.__potim * (2 * np.fft.rfft(vacf, n, axis=0).real - vacf[0])
+
+        return 1e3 * np.fft.rfftfreq(n, self.__potim), vdos
+
+    def get_RDF(
+        self,
+        a: str,
+        b: str | None = None,
+        r_max: float = 6,
+        nbins: int = 200,
+        stride: int = 1,
+        workers: Optional[int] = None,
+        recompute: bool = False,
+    ) -> tuple[Array, Array]:
+        if b is None:
+            b = a
+
+        key = self.__results.key(self.__identity, "rdf", a, b, r_max, nbins, stride)
+
+        result = None if recompute else self.__results.get(key)
+        if result is not None:
+            return result
+
+        posis_a = self.get_atomic_position(a)[::stride]
+        posis_b = self.get_atomic_position(b)[::stride]
+
+        result = radial_distribution(
+            self.__cells[::stride],
+            posis_a,
+            posis_b,
+            r_max,
+            nbins,
+            a.strip() == b.strip(),
+            workers,
+        )
+        self.__results.put(key, result)
+
+        return result
+
+    def get_charge_MSD(
+        self, charges: dict[str, float], recompute: bool = False
+    ) -> tuple[Array, Array, Array]:
+        elements = list(charges.keys())
+        q = np.array([charges[x] for x in elements], dtype=np.float64)
+
+        key = self.__results.key(self.__identity, "charge_msd", charges)
+
+        result = None if recompute else self.__results.get(key)
+        if result is not None:
+            return result
+
+        # Displacement of every species as a whole, so one series per species
+        summed = np.stack(
+            [self.get_atomic_position(x).sum(1, dtype=np.float64) for x in elements],
+            axis=1,
+        )
+        cross = fft_cross_msd(summed)
+
+        # <|dJ|^2> of the charge displacement J = sum_s q_s R_s (e² A²)
+        total = np.einsum("a,b,abtd->td", q, q, cross)
+
+        # Self part from the single atoms MSDs, the rest are the distinct correlations
+        counts = np.array([self.get_atomic_position(x).shape[1] for x in elements])
+        self_part = np.einsum(
+            "s,std->td",
+            np.square(q) * counts,
+            np.stack([self.get_MSD(x, method="fft") for x in elements]),
+        )
+
+        result = total, self_part, total - self_part
+        self.__results.put(key, result)
+
+        return result
+
+    def get_conductivity(
+        self,
+        charges: dict[str, float],
+        temperature: float,
+        fit_start: float = 0.1,
+        fit_end: float = 0.5,
+    ) -> dict[str, float]:
+        msds = self.get_charge_MSD(charges)
+        N = msds[0].shape[0]
+
+        begin = int(fit_start * N)
+        end = max(int(fit_end * N), begin + 2)
+
+        time = self.__potim * np.arange(begin, end)
+        slopes = [np.polyfit(time, msd[begin:end].sum(1), 1)[0] for msd in msds]
+
+        # sigma = e² / (6 V kB T) d<|dJ|^2>/dt, from e² A²/fs and A³ to S/m
+        volume = np.abs(np.linalg.det(self.__cells)).mean()
+        factor = (
+            ELEMENTARY_CHARGE**2 * 1e-5 / (6 * volume * 1e-30 * BOLTZMANN * temperature)
+        )
+
+        return dict(
+            zip(["total", "self", "distinct"], (factor * np.array(slopes)).tolist())
+        )
+
+    def get_MSD_all(
+        self,
+        elements: Optional[list[str]] = None,
+        method: str = "fft",
+        workers: Optional[int] = None,
+        recompute: bool = False,
+        memory_budget: Optional[float] = None,
+        max_lag: Optional[int] = None,
+    ) -> dict[str, Array | tuple[Array, Array]]:
+        if elements is None:
+            elements = self.get_atomic_species()
+
+        if len(elements) == 0:
+            return {}
+
+        if workers is None:
+            workers = cpu_count() or 1
+        workers = max(min(workers, len(elements)), 1)
+
+        # The budget is shared among the species computed at the same time
+        if memory_budget is None:
+            memory_budget = self.__memory_budget
+        if memory_budget is not None:
+            memory_budget /= workers
+
+        # numpy releases the GIL in the heavy kernels, so threads can work at the
+        # same time on the shared positions without copying them
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            msds = pool.map(
+                lambda element: self.get_MSD(
+                    element, method, recompute, memory_budget, max_lag
+                ),
+                elements,
+            )
+
+            return dict(zip(elements, msds))
+
+    @staticmethod
+    def msd_batch_size(n_frames: int, memory_budget: float) -> int:
+        # The msd kernels hold at peak less than ~24 float64 values per atomic
+        # coordinate (copies, squares, cumulative sums and padded spectra)
+        return max(1, int(memory_budget * 2**20) // (24 * 8 * 3 * n_frames))
+
+    @staticmethod
+    def load_block_size(n_atoms: int, memory_budget: float) -> int:
+        # Parsing, unwrapping and drift removal hold at peak less than ~12
+        # float64 values per atomic coordinate of the block
+        return max(1, int(memory_budget * 2**20) // (12 * 8 * 3 * n_atoms))
+
+    @staticmethod
+    def streamed_msd(atomic_positions: Array, kernel, batch_size: int) -> Array:
+        n_atoms = atomic_positions.shape[1]
+
+        # Atoms contribute independently to the MSD, so only a batch of them is
+        # loaded at a time from the positions, that can also be memory mapped
+        msd = 0
+        for start in range(0, n_atoms, batch_size):
+            batch = np.array(atomic_positions[:, start : start + batch_size])
+
+            msd += kernel(batch) * batch.shape[1]
+
+        return msd / n_atoms
+
     @staticmethod
     def fft_lax_msd(atomic_positions: Array) -> Array:
         if fori_loop is None or Array is ndarray:
@@ -238,18 +862,17 @@ class VaspMDAnalyzer:
 
     @staticmethod
     def fft_msd(atomic_positions: Array) -> Array:
-        N = atomic_positions.shape[0]  # Number of frames
-
-        D = np.square(atomic_positions)
-        D1 = np.append(np.zeros_like(D[0:1]), D, 0)
-        D2 = np.append(D, np.zeros_like(D[0:1]), 0)
-
-        S1 = (2 * D.sum(0, keepdims=True) - np.cumsum(D1 + np.flip(D2, 0), 0))[:-1]
+        return fft_msd(atomic_positions)
 
-        S2 = np.fft.fft(atomic_positions, 2 * N, axis=0)
-        S2 = np.fft.ifft(S2 * S2.conjugate(), axis=0)[:N].real
+    @staticmethod
+    def windowed_msd(atomic_positions: Array, max_lag: int) -> Array:
+        return windowed_msd(atomic_positions, max_lag)
 
-        return ((S1 - 2 * S2) / (N - np.arange(N).reshape(N, 1, 1))).mean(1)
+    @staticmethod
+    def multitau_msd(
+        atomic_positions: Array, max_lag: Optional[int] = None
+    ) -> tuple[Array, Array]:
+        return multitau_msd(atomic_positions, max_lag=max_lag)
 
     @staticmethod
     def vectorized_msd(atomic_positions: Array) -> Array:
@@ -293,33 +916,25 @@ class VaspMDAnalyzer:
             np.zeros((N, 3)),
         )
 
-    def write(self, path: str):
-        atoms = self.__get_atoms_string()
-
-        with open(path, "w") as file:
-            for i, (cell, pos) in tqdm(
-                enumerate(zip(self.__cells, self.__atoms_posis))
-            ):
-                file.write("unknown system\n\t1\n")
-
-                cel_line = "\n".join(
-                    map(
-                        lambda x: f"   {x[0]:10.6f}   {x[1]:10.6f}   {x[2]:10.6f}",
-                        cell.tolist(),
-                    )
-                )
-
-                file.write(cel_line)
-                file.write("\n" + atoms)
-                file.write(f"Cartesian configuration= {i+1}\n")
-
-                pos_line = "\n".join(
-                    map(
-                        lambda x: f"   {x[0]:10.8f}  {x[1]:10.8f}  {x[2]:10.8f}",
-                        pos.tolist(),
-                    )
-                )
-                file.write(pos_line + "\n")
+    def write(
+        self,
+        path: str,
+        direct: bool = False,
+        fixed_cell: Optional[bool] = None,
+        stride: int = 1,
+    ):
+        self.__load_pending()
+
+        write_xdatcar(
+            path,
+            self.__atoms,
+            self.__cells,
+            self.__atoms_posis,
+            direct,
+            fixed_cell,
+            stride,
+            verbose=True,
+        )
 
     def __read_xdatcar(
         self,
@@ -327,62 +942,26 @@ class VaspMDAnalyzer:
         start_conf: int,
         nconf: Optional[int],
         jump_elimination: bool,
+        cache: bool = True,
     ):
         # Retrive informations on the atomic species
-        self.__get_atoms_xdatcar(trajectory_path)
-        n_atoms = sum(self.__atoms.values())
-
-        # Look if simulation left cells parameters unchanged
-        read_cells = self.__is_cell_printed(trajectory_path)
+        self.__atoms = read_species(trajectory_path)
 
         # Look if XDATCAR resports coordinate as direct
-        direct_cor = self.__is_coordinate_direct(trajectory_path)
-
-        # Collect atom positions and unit cell at every frame
-        cells, posis = [], []
+        direct_cor = is_coordinate_direct(trajectory_path)
 
-        debug: int = 0
+        # Collect atom positions and unit cell at every frame in a single pass
         print("VaspMDAnalyzer: reading XDATCAR file...")
-        with open(trajectory_path, "r") as data:
-            try:
-                # if cell is fixed then cell is reported in first frame
-                if not read_cells:
-                    cells.append(loadtxt(data, skiprows=2, max_rows=3))
-                    for _ in range(start_conf * (1 + n_atoms) + 2):
-                        data.readline()
-                else:
-                    for _ in range(start_conf * (8 + n_atoms)):
-                        data.readline()
-
-                # Read all other frames
-                if nconf is None:
-                    while not data.readline() == "":
-                        if read_cells:
-                            cells.append(loadtxt(data, skiprows=1, max_rows=3))
-                            posis.append(loadtxt(data, skiprows=3, max_rows=n_atoms))
-                        else:
-                            posis.append(loadtxt(data, max_rows=n_atoms))
-
-                        debug += 1
-                else:
-                    for _ in tqdm(range(nconf)):
-                        if data.readline() == "":
-                            break
-
-                        if read_cells:
-                            cells.append(loadtxt(data, skiprows=1, max_rows=3))
-                            posis.append(loadtxt(data, skiprows=3, max_rows=n_atoms))
-                        else:
-                            posis.append(loadtxt(data, max_rows=n_atoms))
-
-            except Exception as err:
-                print(f"Error in conf {debug}:", err)
-                exit(1)
-
-        self.__cells, self.__atoms_posis = np.array(cells), np.array(posis)
-
-        if not read_cells:
-            self.__cells = np.repeat(self.__cells, self.__atoms_posis.shape[0], axis=0)
+        try:
+            # Far frames are reached seeking with the frames offsets
+            offsets = frame_offsets(trajectory_path, cache) if start_conf > 0 else None
+
+            self.__cells, self.__atoms_posis = parse_xdatcar(
+                trajectory_path, start_conf, nconf, verbose=True, offsets=offsets
+            )
+        except Exception as err:
+            print(err)
+            exit(1)
 
         # --Data postprocessing
         self.__cart_transform(jump_elimination, direct_cor)
@@ -390,116 +969,301 @@ class VaspMDAnalyzer:
 
         print("VaspMDAnalyzer: XDATCAR read succesfully!")
 
-    def __cart_transform(self, jump_elimination: bool, direct_cor: bool) -> None:
-        # --If no jump elimination is required then just transform
-        if not jump_elimination:
-            if direct_cor:
-                self.__atoms_posis = np.einsum(
-                    "ijk,ikl->ijl", self.__atoms_posis, self.__cells
-                )
+    def __stream_xdatcar(
+        self,
+        trajectory_path: str,
+        start_conf: int,
+        nconf: Optional[int],
+        jump_elimination: bool,
+        dtype: DTypeLike,
+        key: Optional[str],
+    ):
+        self.__atoms = read_species(trajectory_path)
+        direct_cor = is_coordinate_direct(trajectory_path)
+
+        # The frames offsets give the size of the trajectory before reading it
+        offsets = frame_offsets(trajectory_path, key is not None)
+        n_frames = len(offsets[start_conf:][:nconf])
+        n_atoms = sum(self.__atoms.values())
+
+        if n_frames == 0:
+            raise ValueError(f"No XDATCAR frame found in {trajectory_path}")
+
+        # Frames are written straight to the cache entry, or to temporary files
+        path = None if key is None else trajectory_path
+        cells, posis = create_trajectory(path, key, n_frames, n_atoms, dtype)
+
+        block = self.load_block_size(n_atoms, self.__memory_budget)
+
+        print("VaspMDAnalyzer: streaming XDATCAR file...")
+        n_read, last, origin = 0, None, None
+        for begin in tqdm(range(0, n_frames, block)):
+            cell, posi = parse_xdatcar(
+                trajectory_path,
+                start_conf + begin,
+                min(block, n_frames - begin),
+                offsets=offsets,
+            )
+
+            if cell.shape[0] == 0:
+                break
+
+            # The last frame of the previous block leads the block, so that the
+            # jumps between the two are found and its images carried over
+            if last is not None:
+                cell = np.append(last[0], cell, 0)
+                posi = np.append(last[1], posi, 0)
+
+            last = cell[-1:].copy(), posi[-1:].copy()
+            posi = self.unwrap_positions(posi, cell, jump_elimination, direct_cor)
+
+            if n_read > 0:
+                cell, posi = cell[1:], posi[1:] + (unwrapped - posi[0])
+
+            unwrapped = posi[-1].copy()
+
+            # Drift with respect to the first frame of the trajectory
+            drift = posi.mean(1)
+            if origin is None:
+                origin = drift[0].copy()
+
+            posi -= (drift - origin)[:, np.newaxis]
+
+            cells[n_read : n_read + cell.shape[0]] = cell
+            posis[n_read : n_read + cell.shape[0]] = posi
+            n_read += cell.shape[0]
+
+        if key is None:
+            self.__cells, self.__atoms_posis = cells[:n_read], posis[:n_read]
+        else:
+            commit_trajectory(path, key, self.__atoms, cells, posis, n_read)
+            _, self.__cells, self.__atoms_posis = load_trajectory(path, key)
+
+        print("VaspMDAnalyzer: XDATCAR streamed succesfully!")
+
+    def __read_segments(
+        self,
+        paths: list[str],
+        start_conf: int,
+        nconf: Optional[int],
+        jump_elimination: bool,
+    ):
+        # All the segments should describe the same system
+        self.__atoms = read_species(paths[0])
+        for path in paths[1:]:
+            if read_species(path) != self.__atoms:
+                raise ValueError(f"Atomic species of {path} differ from {paths[0]}")
+
+        # Segments are parsed at the same time by different processes
+        print(f"VaspMDAnalyzer: reading {len(paths)} XDATCAR segments...")
+        with ProcessPoolExecutor(max_workers=min(len(paths), cpu_count() or 1)) as pool:
+            segments = list(pool.map(parse_xdatcar, paths))
+
+        cells, posis = [], []
+        for path, (cell, posi) in zip(paths, segments):
+            # Segments are joined in direct coordinates, where jumps are found
+            if not is_coordinate_direct(path):
+                posi = np.linalg.solve(
+                    cell.transpose(0, 2, 1)[:, np.newaxis], posi[..., np.newaxis]
+                )[..., 0]
+
+            # Frames of the previous segment repeated by a restarted run are dropped
+            if len(posis) > 0:
+                n = find_overlap(posis[-1], posi[0])
+                cells[-1], posis[-1] = cells[-1][:n], posis[-1][:n]
+
+            cells.append(cell)
+            posis.append(posi)
+
+        stop = None if nconf is None else start_conf + nconf
+        self.__cells = np.concatenate(cells)[start_conf:stop]
+        self.__atoms_posis = np.concatenate(posis)[start_conf:stop]
+
+        # --Data postprocessing on the joined trajectory, so across the segments
+        self.__cart_transform(jump_elimination, True)
+        self.__remove_drift()  # remove the drift of the cell
+
+        print("VaspMDAnalyzer: XDATCAR segments read succesfully!")
+
+    @staticmethod
+    def __resolve_paths(trajectory_path: str | list[str]) -> list[str]:
+        if not isinstance(trajectory_path, str):
+            return list(trajectory_path)
+
+        if not any(x in trajectory_path for x in "*?["):
+            return [trajectory_path]
+
+        # Restart folders are ordered by the numbers they contain, so run10 after run9
+        def natural(path: str):
+            return [int(x) if x.isdigit() else x for x in re.split(r"(\d+)", path)]
+
+        paths = sorted(glob(trajectory_path), key=natural)
+        if len(paths) == 0:
+            raise FileNotFoundError(f"No trajectory matches {trajectory_path}")
+
+        return paths
+
+    def __open_raw(self) -> None:
+        if self.__offsets is not None:
             return
 
-        # --Search for jumps in direct coordinates
-        # If coordinates are not Direct we should transform them
-        if not direct_cor:
-            self.__atoms_posis = np.einsum(
-                "ijk,ilk->ijl",
-                self.__atoms_posis
-                / np.linalg.norm(self.__cells, axis=-2).reshape(
-                    (self.__cells.shape[0], 1, 3)
-                ),
-                self.__cells,
-            ) / np.linalg.norm(self.__cells, axis=-2).reshape(
-                (self.__cells.shape[0], 1, 3)
+        trajectory_path, start_conf, nconf, cache = self.__source
+
+        if not isinstance(trajectory_path, str):
+            raise ValueError("Raw frames are read only from a single XDATCAR")
+
+        offsets = frame_offsets(trajectory_path, cache)
+
+        if len(offsets) == 0:
+            raise ValueError(f"No XDATCAR frame found in {trajectory_path}")
+
+        self.__atoms = read_species(trajectory_path)
+        self.__direct = is_coordinate_direct(trajectory_path)
+        self.__path = trajectory_path
+
+        # Only the offsets of the selected frames are kept
+        self.__offsets = offsets[start_conf:][:nconf]
+
+    def __load_pending(self) -> None:
+        # Analyses running in different threads wait for the same single load,
+        # and the lazy frames are read until it is over
+        with self.__loading:
+            if self.__pending is None:
+                return
+
+            self.__pending()
+            self.__pending = None
+
+    def __get_frame(self, frame: int, raw: bool) -> tuple[Array, Array]:
+        if not raw:
+            self.__load_pending()
+
+            return self.__cells[frame], self.__atoms_posis[frame]
+
+        self.__open_raw()
+        frame = range(len(self.__offsets))[frame]
+
+        # Frames are parsed in blocks kept for the following requests, reading a
+        # whole block ahead only when the frames are asked in order
+        begin, cells, posis = self.__raw_block or (frame, [], None)
+
+        if not begin <= frame < begin + len(cells):
+            ahead = self.__raw_block is not None and 0 <= frame - begin < 2 * LAZY_BLOCK
+
+            cells, posis = parse_xdatcar(
+                self.__path, frame, LAZY_BLOCK if ahead else 1, offsets=self.__offsets
             )
 
-        # Compute difference in position between frames
-        variation = np.diff(self.__atoms_posis, axis=0)
+            if self.__direct:
+                posis = posis @ cells
 
-        # Look where the atoms move more than 0.5 a unit vector
-        jump_right = variation > 0.5
-        jump_left = variation < -0.5
+            begin, posis = frame, posis.astype(self.__dtype, copy=False)
+            self.__raw_block = begin, cells, posis
 
-        # Dected the frame where the jumps occures
-        which_frame = np.any(np.logical_or(jump_right, jump_left), axis=(1, 2))
-        which_frame = np.arange(which_frame.shape[0])[which_frame]
+        return cells[frame - begin], posis[frame - begin]
 
-        # --Transform in cartesian
-        self.__atoms_posis = np.einsum("ijk,ikl->ijl", self.__atoms_posis, self.__cells)
+    def __iter_frames(self, start: int, stop: Optional[int], stride: int, raw: bool):
+        frames = range(self.get_total_frame())[start:stop:stride]
 
-        # --Eliminates the jumps
-        # Separate the cell's unit vector for every frame
-        unit_cell_vectors = np.split(self.__cells, 3, 1)
-
-        # Go through the left or right jump and recall if you have to add or remove a unit vector
-        for jump, mod in zip([jump_right, jump_left], [-1, +1]):
-            # Split the direct components to see where the jump occures
-            jump_and_vector = zip(np.split(jump, 3, 2), unit_cell_vectors)
-
-            # Loop over a tuple having:
-            # 1 - (jump_comp) list of bool telling if the jump along that vector happened for a specific atom in a specific frame
-            # 2 - (component) list of the unit vector related to the looked jump at every frame
-            for jump_comp, component in jump_and_vector:
-                # Go through every jump frame
-                for frame in np.flip(which_frame):
-                    # Create a boolean vector selecting the atom that jumped from the jump frame onward
-                    which_atoms = np.repeat(
-                        jump_comp[frame : frame + 1],
-                        self.__atoms_posis.shape[0],
-                        axis=0,
-                    )
-
-                    idx, _, _ = np.indices(which_atoms.shape)
-                    which_atoms = np.where(idx > frame, which_atoms, False)
-
-                    # Subtract or add the jump vector only to the jump atoms in all the frame after the jump
-                    self.__atoms_posis = np.where(  # pyright: ignore
-                        which_atoms,
-                        self.__atoms_posis + mod * component[frame : frame + 1],
-                        self.__atoms_posis,
-                    )
+        if raw:
+            for frame in frames:
+                yield self.__get_frame(frame, True)
+            return
 
-    def __remove_drift(self) -> None:
-        drift = self.__atoms_posis.mean(1)
-        drift = drift - drift[0]
+        self.__load_pending()
+
+        # Positions stored atom by atom are strided by frame, so blocks of frames
+        # are copied at once
+        for begin in range(0, len(frames), LAZY_BLOCK):
+            block = np.array(frames[begin : begin + LAZY_BLOCK])
+
+            yield from zip(self.__cells[block], np.asarray(self.__atoms_posis[block]))
+
+    def __get_symbols(self) -> list[str]:
+        return np.repeat(
+            list(self.__atoms.keys()), list(self.__atoms.values())
+        ).tolist()
+
+    def __read_cache(self, trajectory_path: str | list[str], key: str) -> bool:
+        cached = load_trajectory(trajectory_path, key)
+
+        if cached is None:
+            return False
 
-        self.__atoms_posis = self.__atoms_posis - drift.reshape(
-            drift.shape[0], 1, drift.shape[1]
+        # Arrays are memory mapped, so they are read from disk only when used
+        self.__atoms, self.__cells, self.__atoms_posis = cached
+
+        print("VaspMDAnalyzer: Trajectory loaded from cache!")
+
+        return True
+
+    def __write_cache(self, trajectory_path: str | list[str], key: str) -> None:
+        try:
+            save_trajectory(
+                trajectory_path, key, self.__atoms, self.__cells, self.__atoms_posis
+            )
+        except OSError as err:
+            print(f"VaspMDAnalyzer: unable to write the cache, {err}")
+
+    def __cart_transform(self, jump_elimination: bool, direct_cor: bool) -> None:
+        self.__atoms_posis = self.unwrap_positions(
+            self.__atoms_posis, self.__cells, jump_elimination, direct_cor
         )
 
-    def __get_atoms_xdatcar(self, xdatcar_path: str) -> None:
-        self.__atoms = dict()
+    def __remove_drift(self) -> None:
+        self.__atoms_posis = self.remove_drift(self.__atoms_posis)
 
-        with open(xdatcar_path, "r") as data:
-            for _ in range(5):
-                data.readline()
+    @staticmethod
+    def unwrap_positions(
+        atoms_posis: Array,
+        cells: Array,
+        jump_elimination: bool = True,
+        direct_cor: bool = True,
+    ) -> Array:
+        # --If no jump elimination is required then just transform
+        if not jump_elimination:
+            if direct_cor:
+                atoms_posis = np.einsum("ijk,ikl->ijl", atoms_posis, cells)
+            return atoms_posis
 
-            species = data.readline().strip().split()
-            numbers = data.readline().strip().split()
+        # --Search for jumps in direct coordinates
+        # If coordinates are not Direct we should transform them
+        if not direct_cor:
+            atoms_posis = np.einsum(
+                "ijk,ilk->ijl",
+                atoms_posis
+                / np.linalg.norm(cells, axis=-2).reshape((cells.shape[0], 1, 3)),
+                cells,
+            ) / np.linalg.norm(cells, axis=-2).reshape((cells.shape[0], 1, 3))
 
-            for key, val in zip(species, numbers):
-                self.__atoms[key] = int(val)
+        # Compute difference in position between frames
+        variation = np.diff(atoms_posis, axis=0)
 
-    def __get_atoms_string(self) -> str:
-        res = "  "
-        res += "  ".join(self.__atoms.keys())
-        res += "\n  "
-        res += "  ".join([str(n) for n in self.__atoms.values()])
+        # Look where the atoms move more than 0.5 a unit vector, counting the unit
+        # vectors to add (jump left) or remove (jump right) from that frame onward
+        jumps = (variation < -0.5).astype(np.int8) - (variation > 0.5).astype(np.int8)
+        del variation
 
-        return res + "\n"
+        # --Transform in cartesian
+        atoms_posis = np.einsum("ijk,ikl->ijl", atoms_posis, cells)
 
-    def __is_cell_printed(self, xdatcar_path: str) -> bool:
-        n_atoms = sum(self.__atoms.values())
+        # --Eliminates the jumps
+        # The image of every frame is the cumulative sum of the previous jumps, where
+        # each jump moves the atom by the unit vector of the frame in which it occured
+        if np.all(cells == cells[0]):
+            images = np.cumsum(jumps, axis=0, dtype=np.int32)
+            shift = np.einsum("ijk,kl->ijl", images, cells[0])
+        else:
+            shift = np.einsum("ijk,ikl->ijl", jumps, cells[:-1])
+            shift = np.cumsum(shift, axis=0)
 
-        with open(xdatcar_path, "r") as file:
-            for _ in range(n_atoms + 8):
-                file.readline()
+        atoms_posis[1:] += shift
 
-            return "configuration" not in file.readline()
+        return atoms_posis
 
-    def __is_coordinate_direct(self, xdatcar_path: str) -> bool:
-        with open(xdatcar_path, "r") as file:
-            for _ in range(7):
-                file.readline()
+    @staticmethod
+    def remove_drift(atoms_posis: Array) -> Array:
+        drift = atoms_posis.mean(1)
+        drift = drift - drift[0]
 
-            return "Direct" in file.readline()
+        return atoms_posis - drift.reshape(drift.shape[0], 1, drift.shape[1])
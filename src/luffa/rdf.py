@@ -0,0 +1,206 @@
+"""Script with the cell-list computation of radial distribution functions over periodic trajectories"""
+
+# ---- IMPORT
+
+# Numpy
+import numpy as np
+
+# Miscellaneus
+from os import cpu_count
+from concurrent.futures import ProcessPoolExecutor
+
+# Typing
+from typing import Optional, Tuple
+from numpy import ndarray
+
+# Buffers
+from .correlation import BATCH_BYTES
+
+# Cell lists with fewer cells are slower than the minimum image convention, which
+# on 500-2000 atoms is faster up to 4 cells per direction and slower from 5
+MINIMUM_IMAGE_CELLS = 125
+
+# ---- FUNCTION
+
+
+def pair_distance_counts(
+    cell: ndarray,
+    posis_a: ndarray,
+    posis_b: ndarray,
+    r_max: float,
+    nbins: int,
+    same: bool = False,
+) -> ndarray:
+    """
+    Histogram of the distances, up to r_max, between the atoms a and the periodic images of the atoms b in a
+    single frame, without building the full distance matrix.
+
+    Atoms are binned in n_c = floor(w / r_max) cells along every lattice vector, with w the distance between
+    the opposite faces of the unit cell, so that the neighbours are only in the 27 adjacent cells. With fewer
+    than MINIMUM_IMAGE_CELLS cells the adjacent ones hold most of the atoms anyway, so if r_max <= w / 2 the
+    minimum image convention is used instead, exact in that range. Otherwise, with fewer than 3 cells along a
+    direction, the images within r_max are reached with offsets beyond the adjacent cells. If same, the atoms
+    a and b are the same and a atom is not paired with itself.
+    """
+    inverse = np.linalg.inv(cell)
+    frac_a = (posis_a @ inverse) % 1.0
+    frac_b = (posis_b @ inverse) % 1.0
+
+    # Distance between opposite faces of the cell
+    faces = np.cross(cell[[1, 2, 0]], cell[[2, 0, 1]])
+    widths = abs(np.linalg.det(cell)) / np.linalg.norm(faces, axis=1)
+
+    # The tolerance keeps the exact multiples of r_max from losing a cell to roundoff
+    n_c = np.maximum(np.floor(widths / r_max + 1e-9), 1).astype(np.int64)
+
+    if n_c.prod() < MINIMUM_IMAGE_CELLS and 2 * r_max <= widths.min():
+        return _minimum_image_counts(cell, frac_a, frac_b, r_max, nbins, same)
+
+    reach = np.ceil(r_max * n_c / widths - 1e-9).astype(np.int64)
+
+    cell_a = np.minimum((frac_a * n_c).astype(np.int64), n_c - 1)
+    cell_b = np.minimum((frac_b * n_c).astype(np.int64), n_c - 1)
+
+    # Occupancy of the cells by the atoms b, padded with -1 to the fullest cell
+    index_b = np.ravel_multi_index(cell_b.T, n_c)
+    occupation = np.bincount(index_b, minlength=n_c.prod())
+
+    order = np.argsort(index_b, kind="stable")
+    slots = np.arange(len(order)) - (np.cumsum(occupation) - occupation)[index_b[order]]
+
+    table = np.full((n_c.prod() + 1, max(occupation.max(), 1)), -1)
+    table[index_b[order], slots] = order
+
+    # Neighbour cells of every atom a, with the lattice image they belong to
+    offsets = np.stack(
+        np.meshgrid(*[np.arange(-r, r + 1) for r in reach], indexing="ij"), -1
+    ).reshape(-1, 1, 3)
+
+    target = cell_a + offsets
+    images = np.floor_divide(target, n_c)
+    target -= images * n_c
+
+    neighbours = table[np.ravel_multi_index(target.reshape(-1, 3).T, n_c)].reshape(
+        len(offsets), len(posis_a), -1
+    )
+
+    xa, xb = frac_a @ cell, frac_b @ cell
+    d = xb[neighbours] + (images @ cell - xa)[:, :, np.newaxis]
+    r2 = np.einsum("...i,...i", d, d)
+
+    mask = (neighbours >= 0) & (r2 < r_max**2)
+    if same:
+        mask &= ~(
+            (neighbours == np.arange(len(posis_a)).reshape(1, -1, 1))
+            & np.all(images == 0, axis=-1)[..., np.newaxis]
+        )
+
+    index = (np.sqrt(r2[mask]) * (nbins / r_max)).astype(np.int64)
+
+    return np.bincount(np.minimum(index, nbins - 1), minlength=nbins)
+
+
+def _minimum_image_counts(
+    cell: ndarray,
+    frac_a: ndarray,
+    frac_b: ndarray,
+    r_max: float,
+    nbins: int,
+    same: bool,
+) -> ndarray:
+    """
+    Histogram of pair_distance_counts with the minimum image convention, from the direct coordinates of the atoms,
+    where the atoms a are taken in chunks so that the distance vectors never exceed BATCH_BYTES
+    """
+    chunk = max(BATCH_BYTES // (8 * 3 * len(frac_b)), 1)
+
+    counts = np.zeros(nbins, np.int64)
+    for start in range(0, len(frac_a), chunk):
+        s = frac_b[np.newaxis] - frac_a[start : start + chunk, np.newaxis]
+        s -= np.round(s)
+
+        d = s @ cell
+        r2 = np.einsum("...i,...i", d, d)
+
+        mask = r2 < r_max**2
+        if same:
+            rows = np.arange(len(s))
+            mask[rows, start + rows] = False
+
+        index = (np.sqrt(r2[mask]) * (nbins / r_max)).astype(np.int64)
+        counts += np.bincount(np.minimum(index, nbins - 1), minlength=nbins)
+
+    return counts
+
+
+def _rdf_chunk(
+    cells: ndarray,
+    posis_a: ndarray,
+    posis_b: ndarray,
+    r_max: float,
+    nbins: int,
+    same: bool,
+) -> ndarray:
+    """
+    Sum of the pair densities of a chunk of frames, each normalized by the volume of its own cell
+    """
+    edges = r_max / nbins * np.arange(nbins + 1)
+    shells = 4 / 3 * np.pi * np.diff(edges**3)
+
+    n_a, n_b = posis_a.shape[1], posis_b.shape[1] - int(same)
+
+    g = np.zeros(nbins)
+    for cell, a, b in zip(cells, posis_a, posis_b):
+        counts = pair_distance_counts(cell, a, b, r_max, nbins, same)
+
+        g += counts * abs(np.linalg.det(cell)) / (n_a * n_b * shells)
+
+    return g
+
+
+def radial_distribution(
+    cells: ndarray,
+    posis_a: ndarray,
+    posis_b: ndarray,
+    r_max: float,
+    nbins: int = 200,
+    same: bool = False,
+    workers: Optional[int] = None,
+) -> Tuple[ndarray, ndarray]:
+    """
+    Radial distribution function g(r) between the atoms a and b, averaged over the frames of the trajectory given
+    by the cells (frames, 3, 3) and positions (frames, atoms, 3). Works for triclinic and variable cells, and the
+    frames are split in chunks processed in parallel by workers processes.
+    Returns the bin centres and g(r)
+    """
+    n_frames = cells.shape[0]
+
+    if workers is None:
+        workers = cpu_count() or 1
+    workers = max(min(workers, n_frames), 1)
+
+    edges = r_max / nbins * np.arange(nbins + 1)
+    r = 0.5 * (edges[1:] + edges[:-1])
+
+    if workers == 1:
+        return r, _rdf_chunk(cells, posis_a, posis_b, r_max, nbins, same) / n_frames
+
+    # A few chunks per worker balance the load between frames of different cost
+    bounds = np.linspace(0, n_frames, 4 * workers + 1).astype(int)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = [
+            pool.submit(
+                _rdf_chunk,
+                np.asarray(cells[start:stop]),
+                np.asarray(posis_a[start:stop]),
+                np.asarray(posis_b[start:stop]),
+                r_max,
+                nbins,
+                same,
+            )
+            for start, stop in zip(bounds[:-1], bounds[1:])
+            if stop > start
+        ]
+
+        return r, sum(chunk.result() for chunk in chunks) / n_frames
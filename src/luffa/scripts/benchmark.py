@@ -0,0 +1,318 @@
+"""Script to benchmark the MSD kernels, the RDF and the trajectory postprocessing on synthetic random walks"""
+
+# ---- IMPORT
+
+import os
+import json
+import tracemalloc
+import numpy as np
+
+from time import perf_counter
+from platform import platform, python_version
+from tempfile import TemporaryDirectory
+from os.path import join
+from argparse import ArgumentParser, Namespace
+from contextlib import redirect_stderr, redirect_stdout
+
+from ..md import VaspMDAnalyzer
+from ..correlation import DIRECT_MAX_LAG
+from ..rdf import radial_distribution
+from ..xdatcar import parse_xdatcar, write_xdatcar
+
+# ---- HELPER FUNCTION
+
+
+def arg_parse() -> Namespace:
+    parser = ArgumentParser(
+        prog="Benchmark MSD",
+        description="Time the MSD methods and the trajectory postprocessing on synthetic random walks",
+    )
+
+    parser.add_argument(
+        "-f",
+        "--frames",
+        type=int,
+        nargs="+",
+        default=[1000, 2000, 4000, 8000],
+        help="Number of frames of the synthetic trajectories, one measure for every value",
+    )
+    parser.add_argument(
+        "-a",
+        "--atoms",
+        type=int,
+        nargs="+",
+        default=[100],
+        help="Number of atoms of the synthetic trajectories, one measure for every value",
+    )
+    parser.add_argument(
+        "-j",
+        "--jump_rate",
+        type=float,
+        default=0.01,
+        help="Probability per frame and atom of a hop of a third of the cell, crossing often the cell boundaries",
+    )
+    parser.add_argument(
+        "-s",
+        "--step",
+        type=float,
+        default=0.01,
+        help="Standard deviation of the random walk step, in direct coordinates",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of repetitions of every measure, the fastest one is kept",
+    )
+    parser.add_argument(
+        "-m",
+        "--memory",
+        type=float,
+        default=16,
+        help="Memory budget (MB) of the measures of the streamed loading and MSD",
+    )
+    parser.add_argument(
+        "-bm",
+        "--base_max_frames",
+        type=int,
+        default=2000,
+        help="Largest number of frames for which the quadratic base method is measured",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="benchmark.json",
+        help="JSON file where the measures are saved, to be used as baseline of later runs",
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        default=None,
+        help="JSON file of a previous run to compare with",
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown with respect to the baseline reported as a regression",
+    )
+    parser.add_argument(
+        "-p",
+        "--plot",
+        default=None,
+        help="Save the scaling curves of the measures with the number of frames in this picture",
+    )
+
+    return parser.parse_args()
+
+
+def random_walk(
+    frames: int, atoms: int, jump_rate: float, step: float, seed: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cells and direct coordinates, wrapped in the cell, of a random walk with rare hops of a third of the cell
+    """
+    rng = np.random.default_rng(seed)
+
+    cell = np.array([[12.0, 0.0, 0.0], [1.0, 11.0, 0.0], [0.5, 0.5, 13.0]])
+    cells = np.repeat(cell[np.newaxis], frames, 0)
+
+    moves = rng.normal(0, step, (frames, atoms, 3))
+    moves += (rng.random((frames, atoms, 3)) < jump_rate) * rng.choice(
+        [-1 / 3, 1 / 3], (frames, atoms, 3)
+    )
+
+    posis = (rng.random((1, atoms, 3)) + np.cumsum(moves, 0)) % 1.0
+
+    return cells, posis
+
+
+def measure(function, repeat: int) -> tuple[float, float]:
+    """
+    Fastest time in seconds and peak of the memory allocated in MB of the calls to function
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak / 2**20
+
+
+def quiet(function):
+    """
+    Function with the messages and progress bars printed by its call suppressed
+    """
+
+    def call():
+        with open(os.devnull, "w") as null, redirect_stdout(null), redirect_stderr(
+            null
+        ):
+            return function()
+
+    return call
+
+
+def benchmark(args: Namespace) -> list[dict]:
+    results = []
+
+    for atoms in args.atoms:
+        for frames in args.frames:
+            cells, direct = random_walk(frames, atoms, args.jump_rate, args.step)
+
+            unwrapped = VaspMDAnalyzer.unwrap_positions(direct.copy(), cells)
+            posis = VaspMDAnalyzer.remove_drift(unwrapped)
+
+            # About 100 frames of the RDF, with r_max between a third and half of
+            # the cell widths where the cell list has too few cells to help
+            stride = max(frames // 100, 1)
+            wrapped = np.einsum("fij,fjk->fik", direct[::stride], cells[::stride])
+
+            cases = {
+                "parse": None,
+                "unwrap": lambda: VaspMDAnalyzer.unwrap_positions(direct.copy(), cells),
+                "drift": lambda: VaspMDAnalyzer.remove_drift(unwrapped),
+                "msd_fft": lambda: VaspMDAnalyzer.fft_msd(posis),
+                "msd_window": lambda: VaspMDAnalyzer.windowed_msd(
+                    posis, max(frames // 10, 1)
+                ),
+                # Short enough to be summed directly instead of cut from the FFT
+                "msd_window_short": lambda: VaspMDAnalyzer.windowed_msd(
+                    posis, DIRECT_MAX_LAG
+                ),
+                "msd_budget": lambda: VaspMDAnalyzer.streamed_msd(
+                    posis,
+                    VaspMDAnalyzer.fft_msd,
+                    VaspMDAnalyzer.msd_batch_size(frames, args.memory),
+                ),
+                "msd_multitau": lambda: VaspMDAnalyzer.multitau_msd(posis),
+                "rdf": lambda: radial_distribution(
+                    cells[::stride], wrapped, wrapped, 5.0, same=True, workers=1
+                ),
+            }
+
+            if frames <= args.base_max_frames:
+                cases["msd_base"] = lambda: VaspMDAnalyzer.vectorized_msd(posis)
+
+            with TemporaryDirectory() as folder:
+                path = join(folder, "XDATCAR")
+                write_xdatcar(path, {"Li": atoms}, cells, direct @ cells)
+
+                cases["parse"] = lambda: parse_xdatcar(path)
+
+                # Parsing, unwrapping and drift removal block by block into temporary files
+                cases["load_budget"] = quiet(
+                    lambda: VaspMDAnalyzer(path, cache=False, memory_budget=args.memory)
+                )
+
+                for name, function in cases.items():
+                    time, peak = measure(function, args.repeat)
+
+                    print(
+                        f"{name:<16s} frames {frames:>8d} atoms {atoms:>6d}  {time:10.4f}s  {peak:10.1f} MB"
+                    )
+
+                    results.append(
+                        dict(
+                            name=name, frames=frames, atoms=atoms, time=time, peak=peak
+                        )
+                    )
+
+    return results
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> int:
+    """
+    Print the ratio between the times of the matching measures, returning the number of regressions
+    """
+    reference = {(x["name"], x["frames"], x["atoms"]): x for x in baseline}
+
+    print(f"\nComparison with the baseline, regressions above {1 + threshold:.2f}x:")
+
+    regressions = 0
+    for result in results:
+        old = reference.get((result["name"], result["frames"], result["atoms"]))
+        if old is None:
+            continue
+
+        ratio = result["time"] / max(old["time"], 1e-12)
+        flag = ratio > 1 + threshold
+        regressions += flag
+
+        print(
+            f"{result['name']:<16s} frames {result['frames']:>8d} atoms {result['atoms']:>6d}  {ratio:6.2f}x  memory {result['peak'] / max(old['peak'], 1e-12):6.2f}x{'  REGRESSION' if flag else ''}"
+        )
+
+    return regressions
+
+
+def plot(results: list[dict], path: str) -> None:
+    import matplotlib.pyplot as plt
+
+    _, ax = plt.subplots()
+
+    for name in dict.fromkeys(x["name"] for x in results):
+        for atoms in dict.fromkeys(x["atoms"] for x in results):
+            points = [
+                (x["frames"], x["time"])
+                for x in results
+                if x["name"] == name and x["atoms"] == atoms
+            ]
+
+            if len(points) > 0:
+                ax.plot(*zip(*points), "o-", label=f"{name} ({atoms} atoms)")
+
+    ax.set_xscale("log")
+    ax.set_yscale("log")
+
+    ax.set_xlabel("frames", fontsize=16)
+    ax.set_ylabel("time (s)", fontsize=16)
+
+    ax.legend(fontsize=8)
+
+    plt.savefig(path, bbox_inches="tight")
+
+
+# ---- MAIN
+
+
+def main():
+    args = arg_parse()
+
+    results = benchmark(args)
+
+    with open(args.output, "w") as file:
+        json.dump(
+            dict(
+                platform=platform(),
+                python=python_version(),
+                numpy=np.__version__,
+                jump_rate=args.jump_rate,
+                step=args.step,
+                results=results,
+            ),
+            file,
+            indent=2,
+        )
+
+    if args.plot is not None:
+        plot(results, args.plot)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)["results"]
+
+        if compare(results, baseline, args.threshold) > 0:
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
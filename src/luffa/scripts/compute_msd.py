@@ -2,7 +2,7 @@ from ..md import VaspMDAnalyzer
 
 from time import time
 from argparse import ArgumentParser
-from numpy import save
+from numpy import save, savez
 
 parser = ArgumentParser(
     prog="Compute MSD",
@@ -11,7 +11,7 @@ parser = ArgumentParser(
 
 parser.add_argument(
     "elements",
-    nargs="?",
+    nargs="*",
     type=str,
     help="Elements for which the MSD should be computed, if none is give than all of them will be used",
 )
@@ -48,6 +48,53 @@ parser.add_argument(
     help="Value of the POTIM variable used in the simulation",
 )
 
+parser.add_argument(
+    "-m",
+    "--memory",
+    type=float,
+    default=None,
+    help="Memory budget in MB, if given the XDATCAR is processed in blocks of frames stored on disk and the atoms of the MSD in batches that fit in it",
+)
+
+parser.add_argument(
+    "-mt",
+    "--method",
+    choices=["fft", "multitau"],
+    default="fft",
+    help="Algorithm used for the MSD, multitau computes it on a logarithmic grid of lags streaming the frames",
+)
+
+parser.add_argument(
+    "-l",
+    "--max_lag",
+    type=int,
+    default=None,
+    help="Number of lags for which the MSD is computed, if not given all of them are used",
+)
+
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    default=1,
+    help="Number of species for which the MSD is computed at the same time",
+)
+
+parser.add_argument(
+    "-b",
+    "--blocks",
+    type=int,
+    default=None,
+    help="Fit the diffusion coefficients on this number of trajectory blocks, printing their mean and standard error",
+)
+
+parser.add_argument(
+    "-s",
+    "--store",
+    action="store_true",
+    help="Store the computed MSDs next to the XDATCAR, so that following runs with the same parameters reuse them",
+)
+
 parser.add_argument(
     "-o",
     "--output",
@@ -65,17 +112,41 @@ def main():
         args.potim,
         start_conf=args.start_conf,
         nconf=args.num_conf,
+        store_results=args.store,
+        memory_budget=args.memory,
     )
 
-    elements = args.elements if args.elements is not None else anal.get_atomic_species()
+    elements = args.elements if args.elements else anal.get_atomic_species()
+
+    print(f"\nCompute MSD for {' '.join(elements)}:")
+    start = time()
+    msds = anal.get_MSD_all(
+        elements,
+        args.method,
+        workers=args.jobs,
+        memory_budget=args.memory,
+        max_lag=args.max_lag,
+    )
+    print(f"Finished in {time() - start:.3f}s")
+
+    for species, msd in msds.items():
+        # Multiple-tau MSDs are saved together with their lags
+        if args.method == "multitau":
+            savez(f"MSD_{species}", lag=msd[0], msd=msd[1])
+        else:
+            save(f"MSD_{species}", msd)
+
+        anal.plot_MSD(species, show=True, method=args.method, max_lag=args.max_lag)
 
-    for species in elements:
-        print(f"\nCompute MSD for {species}:")
-        start = time()
-        save(f"MSD_{species}", anal.get_MSD(species, "fft"))
-        print(f"Finished in {time() - start:.3f}s")
+    if args.blocks:
+        D, err = anal.get_diffusion_blocks(elements, args.blocks)
 
-        anal.plot_MSD(species, show=True)
+        print(f"\nDiffusion coefficients over {args.blocks} blocks:")
+        for species, d, e in zip(elements, D, err):
+            print(
+                f"{species:<3s} D[A²/fs] "
+                + " ".join(f"{x:10.5E} ± {y:8.2E}" for x, y in zip(d, e))
+            )
 
     if args.output:
         anal.write("./XDATCAR_out")
@@ -62,11 +62,16 @@ def arg_parse() -> Namespace:
 def main():
     args = arg_parse()
 
-    # Load the data
+    # Load the data, multiple-tau MSDs are stored together with their lags
     msd = np.load(args.file)
 
+    if isinstance(msd, np.lib.npyio.NpzFile):
+        lag, msd = msd["lag"], msd["msd"]
+    else:
+        lag = np.arange(len(msd))
+
     data = msd[args.beg : args.end]
-    time = np.arange(len(data))
+    time = lag[args.beg : args.end] - lag[args.beg]
 
     # Case where the MSD is computed for the cartesian coordinates
     if data.shape[1] == 3:
@@ -94,14 +99,14 @@ def main():
         if args.save:
             colors = colormaps["magma"].reversed()(np.linspace(0, 1, 4))
             for i, label in enumerate(["X", "Y", "Z"]):
-                plt.plot(msd[:, i], "--", label=label, color=colors[i])
-            plt.plot(msd.sum(-1), label="Total", color=colors[-1], linewidth=3)
+                plt.plot(lag, msd[:, i], "--", label=label, color=colors[i])
+            plt.plot(lag, msd.sum(-1), label="Total", color=colors[-1], linewidth=3)
 
             for color, a, b in zip(colors, Ds, Vs):
                 plt.plot(time, b + time * a, "-", color=color)
 
             plt.xlim(0, time[-1] * 1.1)
-            plt.ylim(0, msd.sum(-1)[time[-1]] * 1.1)
+            plt.ylim(0, msd.sum(-1)[len(time) - 1] * 1.1)
 
             plt.legend()
 
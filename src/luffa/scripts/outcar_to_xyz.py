@@ -3,7 +3,7 @@
 # ---- IMPORTS
 
 # OUTCAR
-from ..outcar import parse_outcar
+from ..outcar import iter_outcar, FIELDS
 
 # NUMPY
 import numpy as np
@@ -26,69 +26,83 @@ def arg_parse() -> Namespace:
     # Options
     parser.add_argument("-o", "--output", default="outcar.xyz")
     parser.add_argument("-a", "--append", action="store_true")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes parsing the ionic steps ahead of the one being written",
+    )
+    parser.add_argument(
+        "-nc",
+        "--no_cache",
+        action="store_true",
+        help="Do not store the offsets of the ionic steps, used by the processes, next to the OUTCAR",
+    )
 
     return parser.parse_args()
 
 
+def step_to_atoms(step: dict) -> Atoms:
+    """
+    Atoms of a single ionic step, as returned by iter_outcar, with all its informations
+    """
+    atoms = Atoms(
+        step["elements"], step["positions"], cell=step["cells"], pbc=(True, True, True)
+    )
+
+    atoms.info["energy"] = step["energies"]
+
+    # Missing outside of MD runs
+    if "temperature" in step:
+        atoms.info["temperature"] = step["temperature"]
+    if "tenergies" in step:
+        atoms.info["tenergy"] = step["tenergies"]
+
+    charge, magmom = step["charge"], step["magmom"]
+
+    atoms.arrays["forces"] = step["forces"]
+    atoms.arrays["charges"] = charge[:, -1]
+    atoms.arrays["magmoms"] = magmom[:, -1]
+    atoms.arrays["decomposed_charge"] = charge[:, :-1]
+    atoms.arrays["decomposed_magmom"] = magmom[:, :-1]
+
+    occup_up, occup_dw = np.asarray(step["occup_up"]), np.asarray(step["occup_dw"])
+
+    # See if present
+    if len(occup_up) == 0:
+        occup_up = 0.5 * (charge[:, :-1] - magmom[:, :-1])
+        occup_dw = 0.5 * (charge[:, :-1] + magmom[:, :-1])
+
+        atoms.arrays["toccups"] = np.append(occup_up, occup_dw, axis=1)
+    else:
+        atoms.arrays["toccups"] = np.dstack(
+            (
+                np.trace(occup_dw, axis1=-1, axis2=-2),
+                np.trace(occup_up, axis1=-1, axis2=-2),
+            )
+        )[0]
+
+    return atoms
+
+
 # ---- MAIN
 def main():
     args = arg_parse()
 
-    # Parse the OUTCAR
-    data = parse_outcar(args.outcar, True)
-
-    # Get the elements
-    elements = data.pop("elements")
-
-    # Pop all empty things
-    keys = filter(lambda x: len(data[x]) == 0, list(data.keys()).copy())
-    for key in keys:
-        data.pop(key)
-
-    # Create Atoms trajectory
-    traj: list[Atoms] = []
-    for (
-        position,
-        force,
-        energy,
-        occup_up,
-        occup_dw,
-        magmom,
-        charge,
-        tenergy,
-        temp,
-        cell,
-        _,
-    ) in zip(*data.values()):
-        atoms = Atoms(elements, position, cell=cell, pbc=(True, True, True))
-
-        atoms.info["energy"] = energy
-        atoms.info["temperature"] = temp
-        atoms.info["tenergy"] = tenergy
-
-        atoms.arrays["forces"] = force
-        atoms.arrays["charges"] = charge[:, -1]
-        atoms.arrays["magmoms"] = magmom[:, -1]
-        atoms.arrays["decomposed_charge"] = charge[:, :-1]
-        atoms.arrays["decomposed_magmom"] = magmom[:, :-1]
-
-        # See if present
-        if len(occup_up) == 0:
-            occup_up = 0.5 * (charge[:, :-1] - magmom[:, :-1])
-            occup_dw = 0.5 * (charge[:, :-1] + magmom[:, :-1])
-
-            atoms.arrays["toccups"] = np.append(occup_up, occup_dw, axis=1)
-        else:
-            atoms.arrays["toccups"] = np.dstack(
-                (
-                    np.trace(occup_dw, axis1=-1, axis2=-2),
-                    np.trace(occup_up, axis1=-1, axis2=-2),
-                )
-            )[0]
-
-        traj.append(atoms)
-
-    write(args.output, traj, format="extxyz", append=args.append)
+    # Everything but the volume, already given by the cell
+    fields = [key for key in FIELDS if key != "volume"]
+
+    # Stream the steps of the OUTCAR to the xyz file, one at a time
+    with open(args.output, "a" if args.append else "w") as file:
+        for n, step in enumerate(
+            iter_outcar(args.outcar, fields, args.jobs, cache=not args.no_cache)
+        ):
+            print(f"Writing ionic step: {n:>6d}", end="\r")
+
+            write(file, step_to_atoms(step), format="extxyz")
+
+    print()
 
 
 if __name__ == "__main__":
@@ -11,6 +11,10 @@ from argparse import ArgumentParser, Namespace
 
 import threading
 
+from os.path import splitext
+
+from ..correlation import fft_msd, MultiTauMSD
+
 # ---- HELPER FUNCTION
 
 
@@ -20,21 +24,6 @@ def unit_vector(theta: float, phi: float) -> np.ndarray:
     )
 
 
-def fft_msd(atomic_positions: np.ndarray) -> np.ndarray:
-    N = atomic_positions.shape[0]  # Number of frames
-
-    D = np.square(atomic_positions)
-    D1 = np.append(np.zeros_like(D[0:1]), D, 0)
-    D2 = np.append(D, np.zeros_like(D[0:1]), 0)
-
-    S1 = (2 * D.sum(0, keepdims=True) - np.cumsum(D1 + np.flip(D2, 0), 0))[:-1]
-
-    S2 = np.fft.fft(atomic_positions, 2 * N, axis=0)
-    S2 = np.fft.ifft(S2 * S2.conjugate(), axis=0)[:N].real
-
-    return ((S1 - 2 * S2) / (N - np.arange(N).reshape(N, 1, 1))).mean(1)
-
-
 def arg_parse() -> Namespace:
     parser = ArgumentParser()
 
@@ -70,6 +59,13 @@ def arg_parse() -> Namespace:
         help="Cut the trajectory in chunks and average over it, needed if the amount of data is too large",
     )
 
+    parser.add_argument(
+        "-m",
+        "--multitau",
+        action="store_true",
+        help="Stream the frames through a multiple-tau correlator, computing the MSD on a logarithmic grid of lags with constant memory",
+    )
+
     parser.add_argument("-o", "--output", default="POL_MSD.npy")
 
     return parser.parse_args()
@@ -124,6 +120,73 @@ def compute_msd(msd, file, i, delta, project: bool = False):
     msd[i] = fft_msd(position[:, np.newaxis, :])
 
 
+def compute_multitau_msd(
+    file, beg: int, end: int, project: bool = False, block: int = 10_000
+) -> tuple[np.ndarray, np.ndarray]:
+    file = tb.open_file(file)
+
+    cell = file.root.cell.read()
+    mass = atomic_masses[np.int32(file.root.species.read())]
+
+    # Directions of the projections
+    n_proj = np.linspace(0, 2 * np.pi, 100)
+    directions = np.array([unit_vector(theta, np.pi * 0.5) for theta in n_proj]).T
+
+    correlator = MultiTauMSD(1, len(n_proj) if project else 3)
+
+    last_position, last_polaron = None, None
+    for start in range(beg, end, block):
+        stop = min(start + block, end)
+
+        print(f"Streaming data between frames: {start:<7d} ===> {stop:<7d}")
+
+        position = file.root.frames.read(start, stop, field="positions")
+        pol_inde = file.root.frames.read(start, stop, field="polaron")
+
+        # Unwrap the coordinates continuing from the last frame of the previous block
+        if last_position is None:
+            last_position = position[0]
+
+        position = np.unwrap(
+            np.append(last_position[np.newaxis], position, 0), axis=0, period=1
+        )[1:]
+
+        # Copy, as the drift is removed in place right after
+        last_position = position[-1].copy()
+
+        # Avoid drifting
+        position -= (
+            np.sum(position * mass[:, np.newaxis], axis=1, keepdims=True) / mass.sum()
+        )
+
+        # Take the polaron position
+        position = np.sum(position * pol_inde[..., np.newaxis], axis=-2)
+
+        # Unwrap polaron position
+        if last_polaron is None:
+            last_polaron = position[0]
+
+        position = np.unwrap(
+            np.append(last_polaron[np.newaxis], position, 0), axis=0, period=1
+        )[1:]
+        last_polaron = position[-1]
+
+        # Transform coordinates to cartesian
+        position = np.einsum("jk,kl->jl", position, cell)
+
+        # Project positions
+        if project:
+            position = position @ directions
+
+        # Feed the correlator one frame at a time
+        for frame in position:
+            correlator.update(frame[np.newaxis])
+
+    file.close()
+
+    return correlator.result()
+
+
 # ---- MAIN
 
 
@@ -138,6 +201,12 @@ def main():
 
         file.close()
 
+    # Streaming version, saved together with the lags
+    if args.multitau:
+        lag, msd = compute_multitau_msd(args.file, args.beg, args.end, args.project)
+        np.savez(splitext(args.output)[0], lag=lag, msd=msd)
+        return
+
     # Compute chunks values
     n_steps_per_chunk = (args.end - args.beg) // np.abs(args.chunks)
 
@@ -0,0 +1,359 @@
+"""Script for the parsing of the XDATCAR produced by a VASP MD run in a single pass over the file"""
+
+# ---- IMPORT
+
+# Numpy
+import numpy as np
+from numpy import loadtxt
+
+# Miscellaneus
+import mmap
+from itertools import islice
+from os.path import getsize
+from time import perf_counter
+from tqdm import tqdm
+
+# Cache
+from .cache import cached_index
+
+# Typing
+from typing import Dict, Optional, Sequence, TextIO, Tuple, Union
+from numpy import ndarray
+
+# Formats of the XDATCAR written by VASP
+CELL_FORMAT = "  %11.6f %11.6f %11.6f\n" * 3
+POSITION_FORMAT = " %11.8f %11.8f %11.8f\n"
+
+# ---- FUNCTION
+
+
+def read_species(path: str) -> Dict[str, int]:
+    """
+    Read the atomic species and the number of atoms per species from the XDATCAR header
+    """
+    with open(path, "r") as data:
+        for _ in range(5):
+            data.readline()
+
+        species = data.readline().strip().split()
+        numbers = data.readline().strip().split()
+
+    return {key: int(val) for key, val in zip(species, numbers)}
+
+
+def is_cell_printed(path: str, n_atoms: int) -> bool:
+    """
+    Look if the unit cell is printed at every frame, as happens for variable cell simulations
+    """
+    with open(path, "r") as file:
+        for _ in range(n_atoms + 8):
+            file.readline()
+
+        return "configuration" not in file.readline()
+
+
+def is_coordinate_direct(path: str) -> bool:
+    """
+    Look if the XDATCAR reports the atomic positions as direct coordinates
+    """
+    with open(path, "r") as file:
+        for _ in range(7):
+            file.readline()
+
+        return "Direct" in file.readline()
+
+
+def scan_frame_offsets(path: str) -> ndarray:
+    """
+    Byte offsets at which every frame of the XDATCAR starts, found with a raw scan of the file for the
+    "configuration=" headers. For variable cell trajectories the frame starts with the seven lines of
+    its cell header, that are skipped backward from the configuration line
+    """
+    n_atoms = sum(read_species(path).values())
+    frame_head = 7 if is_cell_printed(path, n_atoms) else 0
+
+    offsets = []
+    with open(path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        pos = data.find(b"configuration=")
+        while pos >= 0:
+            begin = data.rfind(b"\n", 0, pos)
+            for _ in range(frame_head):
+                begin = data.rfind(b"\n", 0, begin)
+
+            offsets.append(begin + 1)
+            pos = data.find(b"configuration=", pos + 1)
+
+    return np.array(offsets, dtype=np.int64)
+
+
+def frame_offsets(path: str, cache: bool = True) -> ndarray:
+    """
+    Byte offsets of the frames of the XDATCAR, stored next to the file after the first scan
+    """
+    return cached_index(path, scan_frame_offsets, cache)
+
+
+def find_overlap(
+    previous: ndarray, first: ndarray, tail: int = 1000, tol: float = 1e-6
+) -> int:
+    """
+    Index of the frame of the previous segment, searched among its last tail frames, that is repeated as first
+    frame of the next one, as happens for runs restarted from an earlier point. Frames are compared in direct
+    coordinates up to the periodic images, and the length of the segment is returned if no frame is repeated
+    """
+    start = max(len(previous) - tail, 0)
+
+    d = np.asarray(previous[start:]) - first
+    d -= np.round(d)
+
+    matches = np.flatnonzero(np.abs(d).max(axis=(1, 2)) < tol)
+
+    return start + matches[0] if len(matches) > 0 else len(previous)
+
+
+def _grow(array: ndarray, size: int) -> ndarray:
+    """
+    Reallocate the array along the first axis keeping the already filled data
+    """
+    new = np.empty((size,) + array.shape[1:], dtype=array.dtype)
+    new[: min(size, array.shape[0])] = array[:size]
+
+    return new
+
+
+def parse_xdatcar(
+    path: str,
+    start_conf: int = 0,
+    nconf: Optional[int] = None,
+    block_size: int = 1 << 24,
+    verbose: bool = False,
+    offsets: Optional[ndarray] = None,
+) -> Tuple[ndarray, ndarray]:
+    """
+    Parses the frames of an XDATCAR in a single pass, returning the unit cells and the atomic positions
+    as two preallocated arrays of shape (frames, 3, 3) and (frames, atoms, 3).
+
+    The file is consumed in blocks of roughly block_size bytes, every block being converted with a single
+    call to loadtxt, and both the fixed cell and variable cell layouts are supported.
+    If verbose the throughput of the reading is printed in MB/s. When the byte offsets of the frames are given
+    the file is read starting straight from the first wanted frame.
+    """
+    n_atoms = sum(read_species(path).values())
+
+    # Look if simulation left cells parameters unchanged
+    read_cells = is_cell_printed(path, n_atoms)
+
+    # Lines preceding the atomic positions in every frame and total lines in the frame
+    frame_head = 8 if read_cells else 1
+    frame_lines = n_atoms + frame_head
+
+    start = perf_counter()
+    with open(path, "rb") as data:
+        # if cell is fixed then cell is reported only in the header
+        fixed_cell = None
+        if not read_cells:
+            header = list(islice(data, 7))
+            fixed_cell = loadtxt(header[2:5])
+
+        # Skip the unwanted configurations
+        if offsets is None:
+            for _ in islice(data, start_conf * frame_lines):
+                pass
+        elif start_conf < len(offsets):
+            data.seek(offsets[start_conf])
+        else:
+            data.seek(0, 2)
+
+        remaining = getsize(path) - data.tell()
+
+        # Read the first frame to estimate the number of frames contained in the file
+        lines = list(islice(data, frame_lines))
+        frame_bytes = max(sum(len(line) for line in lines), 1)
+
+        n_alloc = max(remaining // frame_bytes + 1, 1)
+        if offsets is not None:
+            n_alloc = max(len(offsets) - start_conf, 1)
+        if nconf is not None:
+            n_alloc = min(n_alloc, nconf)
+
+        cells = np.empty((n_alloc, 3, 3))
+        posis = np.empty((n_alloc, n_atoms, 3))
+
+        frames_per_block = max(block_size // frame_bytes, 1)
+        if nconf is not None:
+            frames_per_block = min(frames_per_block, nconf)
+        progress = tqdm(total=remaining, unit="B", unit_scale=True, disable=not verbose)
+
+        n_read, n_bytes = 0, 0
+        while len(lines) >= frame_lines:
+            # Only complete frames are parsed, the rest is left in the file
+            n_frames = len(lines) // frame_lines
+            if nconf is not None:
+                n_frames = min(n_frames, nconf - n_read)
+
+            if n_read + n_frames > posis.shape[0]:
+                n_alloc = max(n_read + n_frames, int(1.25 * posis.shape[0]))
+                cells, posis = _grow(cells, n_alloc), _grow(posis, n_alloc)
+
+            # Only the complete frames that are wanted are kept
+            del lines[n_frames * frame_lines :]
+            block_bytes = sum(len(line) for line in lines)
+
+            try:
+                if read_cells:
+                    cells[n_read : n_read + n_frames] = np.stack(
+                        [loadtxt(lines[k::frame_lines], ndmin=2) for k in range(2, 5)],
+                        axis=1,
+                    )
+                else:
+                    cells[n_read : n_read + n_frames] = fixed_cell
+
+                # Drop the frame headers starting from the last line of the header
+                for j, k in enumerate(reversed(range(frame_head))):
+                    del lines[k :: frame_lines - j]
+
+                posis[n_read : n_read + n_frames] = loadtxt(lines, ndmin=2).reshape(
+                    n_frames, n_atoms, 3
+                )
+            except ValueError as err:
+                raise ValueError(
+                    f"Error in conf between {start_conf + n_read} and {start_conf + n_read + n_frames}: {err}"
+                ) from err
+
+            n_read += n_frames
+            n_bytes += block_bytes
+            progress.update(block_bytes)
+
+            if nconf is not None and n_read >= nconf:
+                break
+
+            lines = list(islice(data, frames_per_block * frame_lines))
+
+        progress.close()
+
+    elapsed = perf_counter() - start
+
+    if verbose:
+        print(
+            f"XDATCAR: read {n_read} frames, {n_bytes / 1e6:.1f} MB in {elapsed:.3f}s ({n_bytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s)"
+        )
+
+    return cells[:n_read], posis[:n_read]
+
+
+def xdatcar_header(
+    species: Union[Dict[str, int], Sequence[Tuple[str, int]]],
+    cell: Optional[ndarray] = None,
+    title: str = "unknown system",
+) -> str:
+    """
+    Header of an XDATCAR frame, with the title, the scale, the cell and the atomic species. If the cell is
+    not given the cell lines are left as format fields to be filled frame by frame. The species can also be
+    given as a sequence of (element, count) pairs, for atoms not grouped by element
+    """
+    species = list(species.items()) if isinstance(species, dict) else list(species)
+
+    header = f"{title}\n           1\n"
+
+    # Left as a format string the header has its percent signs escaped
+    if cell is None:
+        header = header.replace("%", "%%") + CELL_FORMAT
+    else:
+        header += CELL_FORMAT % tuple(np.ravel(cell))
+    header += "".join(f" {x:3s}" for x, _ in species) + "\n"
+    header += "".join(f" {n:3d}" for _, n in species) + "\n"
+
+    return header
+
+
+def write_xdatcar_frames(
+    file: TextIO,
+    species: Union[Dict[str, int], Sequence[Tuple[str, int]]],
+    cells: ndarray,
+    posis: ndarray,
+    first: int = 1,
+    direct: bool = True,
+    fixed_cell: bool = False,
+    title: str = "unknown system",
+) -> None:
+    """
+    Write a block of frames of shape (frames, atoms, 3), whose positions are already in the direct or cartesian
+    coordinates to report, numbering them from first. The whole block is formatted with a single call, and with a
+    fixed cell the header is not repeated in the frames, leaving to the caller writing it once with xdatcar_header
+    """
+    n_frames, n_atoms, _ = posis.shape
+    if n_frames == 0:
+        return
+
+    frame = f"{'Direct' if direct else 'Cartesian'} configuration=%6d\n"
+    frame += POSITION_FORMAT * n_atoms
+
+    columns = [
+        np.arange(first, first + n_frames).reshape(-1, 1),
+        posis.reshape(n_frames, -1),
+    ]
+    if not fixed_cell:
+        frame = xdatcar_header(species, title=title) + frame
+        columns.insert(0, np.reshape(cells, (n_frames, 9)))
+
+    file.write(
+        (frame * n_frames) % tuple(np.concatenate(columns, axis=1).ravel().tolist())
+    )
+
+
+def write_xdatcar(
+    path: str,
+    species: Dict[str, int],
+    cells: ndarray,
+    posis: ndarray,
+    direct: bool = True,
+    fixed_cell: Optional[bool] = None,
+    stride: int = 1,
+    block_size: int = 1 << 22,
+    title: str = "unknown system",
+    verbose: bool = False,
+) -> None:
+    """
+    Write the trajectory given by the cells (frames, 3, 3) and the cartesian positions (frames, atoms, 3) as an
+    XDATCAR with direct or cartesian coordinates, keeping one frame every stride. The frames are formatted in
+    blocks of roughly block_size bytes and, if the cell is fixed, the cell is written only once in the header.
+    By default the cell is considered fixed if it is the same in all the frames
+    """
+    cells, posis = cells[::stride], posis[::stride]
+    n_frames, n_atoms, _ = posis.shape
+
+    if fixed_cell is None:
+        fixed_cell = n_frames > 0 and bool(np.all(cells == cells[0]))
+
+    frames_per_block = max(block_size // (40 * (n_atoms + 8)), 1)
+
+    with open(path, "w") as file:
+        if fixed_cell and n_frames > 0:
+            file.write(xdatcar_header(species, cells[0], title))
+
+        for start in tqdm(range(0, n_frames, frames_per_block), disable=not verbose):
+            block_cells = np.asarray(
+                cells[start : start + frames_per_block], np.float64
+            )
+            block_posis = np.asarray(
+                posis[start : start + frames_per_block], np.float64
+            )
+
+            if direct:
+                block_posis = np.linalg.solve(
+                    block_cells.transpose(0, 2, 1)[:, np.newaxis],
+                    block_posis[..., np.newaxis],
+                )[..., 0]
+
+            write_xdatcar_frames(
+                file,
+                species,
+                block_cells,
+                block_posis,
+                start + 1,
+                direct,
+                fixed_cell,
+                title,
+            )